@@ -0,0 +1,226 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pygame
+
+import scratch
+
+COUNTS = [100, 500, 1000, 5000, 10000, 20000, 50000]
+FRAME_TIME = 1000 / scratch.TMR_SPEED
+PHASES = ("update", "collision", "draw", "display")
+
+# (pattern, period in ms); a period of 0 fires once when measuring starts
+SCENARIOS = {
+    "slow_hell": [("slow_hell", 25)],
+    "make_circ_bullets": [("make_circ_bullets", 50)],
+    "create_targeted_circle": [("create_targeted_circle", 200)],
+    "make_bullet_circle_2": [("make_bullet_circle_2", 125)],
+    "outer_circle": [("outer_circle", 0)],
+    "precision": [("precision", 50)],
+    "make_beam_grid": [("make_beam_grid", 475)],
+    # the overlaps main() schedules
+    "targeted_circles_and_beam_grid": [("make_circ_bullets", 50), ("make_beam_through_player", 100),
+                                       ("create_targeted_circle", 200), ("make_beam_grid", 475)],
+    "slow_hell_and_slow_burst": [("slow_hell", 25), ("slow_burst", 1000)],
+    "outer_circle_and_homing_2": [("outer_circle", 0), ("make_homing_2", 100)],
+    "bullet_circle_2_and_pentagram_2": [("make_bullet_circle_2", 125), ("pentagram_2", 500)],
+    "precision_blast_and_precision": [("precision_blast", 0), ("precision", 50)],
+}
+
+# scenarios made only of beams, or of patterns that steer existing bullets, are filled with this instead
+FILLER = "slow_burst"
+
+
+def reset():
+    scratch.BULLETS = scratch.BulletStore()
+    scratch.BEAMS = scratch.BeamStore()
+    scratch.SPRITES = scratch.SpriteCache()
+    scratch.reset_run(0)
+    scratch.TIMELINE.clear()
+    scratch.player.health = 10 ** 9
+
+
+def fill(patterns, count):
+    # spawn until the store holds count bullets, then scatter them along their own paths over the playfield
+    bullets = scratch.BULLETS
+    fillers = [name for name, period in patterns if name not in ("outer_circle", "precision_blast")]
+    n = 0
+    for attempt in range(50):
+        for name in fillers:
+            getattr(scratch, name)(n)
+        n += 1
+        if bullets.live_count() > 0:
+            break
+    else:
+        fillers = [FILLER]
+    while bullets.live_count() < count:
+        for name in fillers:
+            getattr(scratch, name)(n)
+        n += 1
+        bullets.compact()
+    # beams spawned while filling would scale with the bullet count; the scheduled events bring their own
+    scratch.BEAMS.clear()
+    cap(count)
+    live = bullets.live()
+    travel = np.random.default_rng(count).uniform(0, 2000, len(live))
+    bullets.x[live] += bullets.x_speed[live] * bullets.speed[live] * travel
+    bullets.y[live] += bullets.y_speed[live] * bullets.speed[live] * travel
+    bullets.rebase(live)
+    wrap()
+
+
+def cap(count):
+    live = scratch.BULLETS.live()
+    scratch.BULLETS.alive[live[count:]] = False
+
+
+def wrap():
+    # keep the load on screen: nothing dies off the edge and the bullet count stays put
+    bullets = scratch.BULLETS
+    live = bullets.live()
+    fresh = ~bullets.survive_off_screen[live]
+    bullets.survive_off_screen[live] = True
+    x = bullets.x[live] % scratch.screen.get_width()
+    y = bullets.y[live] % scratch.screen.get_height()
+    moved = (x != bullets.x[live]) | (y != bullets.y[live])
+    bullets.x[live] = x
+    bullets.y[live] = y
+    bullets.prev_x[live[moved]] = x[moved]
+    bullets.prev_y[live[moved]] = y[moved]
+    # rebasing also reschedules the exit of bullets that have only just been made to survive
+    bullets.rebase(live[moved | fresh])
+
+
+def schedule(patterns, frames):
+    chart = {"length": frames * FRAME_TIME + 1000,
+             "events": [{"pattern": name, "period": period, "end": 1 if period == 0 else None}
+                        for name, period in patterns]}
+    scratch.TIMELINE.load(scratch.compile_chart(chart))
+
+
+def frame(count, alpha, timings):
+    start = time.perf_counter()
+    steps = int(FRAME_TIME // scratch.SIM_STEP)
+    for step in range(steps):
+        scratch.step_world(scratch.SIM_STEP)
+        mid = time.perf_counter()
+        scratch.check_col(scratch.player)
+        end = time.perf_counter()
+        timings["update"] += mid - start
+        timings["collision"] += end - mid
+        start = end
+    rects = scratch.draw(alpha)
+    drawn = time.perf_counter()
+    pygame.display.update(rects)
+    end = time.perf_counter()
+    timings["draw"] += drawn - start
+    timings["display"] += end - drawn
+    cap(count)
+    wrap()
+
+
+def measure(name, count, frames):
+    patterns = SCENARIOS[name]
+    reset()
+    fill(patterns, count)
+    schedule(patterns, frames)
+    phase_times = {phase: [] for phase in PHASES}
+    frame_times = []
+    beams = 0
+    tests = scratch.BULLETS.narrow_tests
+    for index in range(frames):
+        timings = dict.fromkeys(PHASES, 0)
+        frame(count, index % 4 / 4, timings)
+        for phase in PHASES:
+            phase_times[phase].append(timings[phase] * 1000)
+        frame_times.append(sum(timings.values()) * 1000)
+        beams += scratch.BEAMS.live_count()
+    tests = scratch.BULLETS.narrow_tests - tests
+
+    # a separate pass, since tracing allocations would skew the timings above
+    reset()
+    tracemalloc.start()
+    fill(patterns, count)
+    schedule(patterns, frames)
+    for index in range(min(frames, 20)):
+        frame(count, 1, dict.fromkeys(PHASES, 0))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    result = {"scenario": name, "bullets": count, "beams": beams / frames, "frames": frames,
+              "narrow_tests": tests / frames}
+    for phase in PHASES:
+        result[phase + "_ms"] = float(np.mean(phase_times[phase]))
+    result["frame_p50_ms"] = float(np.percentile(frame_times, 50))
+    result["frame_p99_ms"] = float(np.percentile(frame_times, 99))
+    result["peak_memory_bytes"] = peak
+    return result
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as file:
+        baseline = {(row["scenario"], row["bullets"]): row for row in json.load(file)["results"]}
+    print()
+    print("%-34s %7s %12s %12s" % ("vs " + os.path.basename(baseline_path), "bullets", "p50", "p99"))
+    for row in results:
+        old = baseline.get((row["scenario"], row["bullets"]))
+        if old is None:
+            continue
+        print("%-34s %7d %11.2fx %11.2fx" % (row["scenario"], row["bullets"], old["frame_p50_ms"] / row["frame_p50_ms"],
+                                             old["frame_p99_ms"] / row["frame_p99_ms"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="time the engine under fixed bullet loads")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--counts", nargs="+", type=int, default=COUNTS)
+    parser.add_argument("--frames", type=int, default=120)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", metavar="BASELINE", help="print speedups against an earlier results file")
+    parser.add_argument("--dummy-display", action="store_true", help="use SDL's dummy video driver")
+    parser.add_argument("--framebuffer", action="store_true", help="draw with the NumPy software renderer")
+    args = parser.parse_args()
+
+    if args.dummy_display:
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+    scratch.init_display()
+    if args.framebuffer:
+        scratch.FRAMEBUFFER = scratch.Framebuffer(scratch.screen.get_width(), scratch.screen.get_height())
+
+    results = []
+    print("%-34s %7s %7s %7s %9s %9s %9s %9s %8s %8s %9s" % ("scenario", "bullets", "beams", "tests", "update",
+                                                           "collide", "draw", "display", "p50", "p99", "peak MB"))
+    for name in args.scenarios:
+        for count in args.counts:
+            row = measure(name, count, args.frames)
+            results.append(row)
+            print("%-34s %7d %7.0f %7.0f %9.2f %9.2f %9.2f %9.2f %8.2f %8.2f %9.1f" % (
+                name, count, row["beams"], row["narrow_tests"], row["update_ms"], row["collision_ms"], row["draw_ms"], row["display_ms"],
+                row["frame_p50_ms"], row["frame_p99_ms"], row["peak_memory_bytes"] / 2 ** 20))
+
+    meta = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "pygame": pygame.version.ver,
+        "platform": platform.platform(),
+        "video_driver": pygame.display.get_driver(),
+        "renderer": "framebuffer" if args.framebuffer else "sprites",
+        "sim_step_ms": scratch.SIM_STEP,
+        "frame_time_ms": FRAME_TIME,
+    }
+    with open(args.output, "w") as file:
+        json.dump({"meta": meta, "results": results}, file, indent=2)
+    print("wrote", args.output)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import argparse
+import concurrent.futures
+import json
+import math
+import os
+import random
+import time
+
+import numpy as np
+import pygame
+
+import scratch
+
+# bot runs keep going after the player would have died, so every segment of the song gets measured;
+# the death time is when the damage taken reaches the normal starting health
+IMMORTAL_HEALTH = 10 ** 9
+
+
+def run_bot(seed, segment=1000, duration=scratch.SONG_LENGTH):
+    scratch.BOT = scratch.DodgeBot()
+    scratch.start_run(seed)
+    health = scratch.player.health
+    scratch.player.health = IMMORTAL_HEALTH
+    damage = np.zeros(math.ceil(duration / segment), np.int32)
+    death = None
+    simulated = 0
+    while simulated < duration:
+        before = scratch.player.health
+        scratch.simulate(scratch.SIM_STEP)
+        lost = before - scratch.player.health
+        if lost:
+            damage[int(simulated // segment)] += lost
+            if death is None and IMMORTAL_HEALTH - scratch.player.health >= health:
+                death = simulated + scratch.SIM_STEP
+        simulated += scratch.SIM_STEP
+    return damage, death
+
+
+def run_batch(seeds, segment, duration):
+    return [run_bot(seed, segment, duration) for seed in seeds]
+
+
+def run_seeds(seeds, segment, duration, workers):
+    # batches in seed order, and results come back in that order whichever worker ran them, so the totals
+    # only depend on the seeds
+    batch = max(1, min(16, len(seeds) // (workers * 4)))
+    batches = [seeds[i:i + batch] for i in range(0, len(seeds), batch)]
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        results = pool.map(run_batch, batches, [segment] * len(batches), [duration] * len(batches))
+        return [result for batch_results in results for result in batch_results]
+
+
+def survival_curve(deaths, segments, segment):
+    ends = (np.arange(segments) + 1) * segment
+    deaths = np.array([np.inf if death is None else death for death in deaths])
+    return (deaths[:, None] > ends).mean(0)
+
+
+def save_image(path, damage, survival, segment):
+    # heatmap: one column per segment, one row per amount of damage taken in it, shaded by share of runs
+    segments = damage.shape[1]
+    rows = int(damage.max()) + 1
+    share = np.stack([(damage == row).mean(0) for row in range(rows)])
+    cell_w = max(4, 1000 // segments)
+    cell_h = max(4, 300 // rows)
+    plot_h = 200
+    surface = pygame.Surface((segments * cell_w, rows * cell_h + plot_h + 10))
+    surface.fill((0, 0, 0))
+    for row in range(rows):
+        for column in range(segments):
+            value = int(255 * share[row, column] ** 0.5)
+            surface.fill((value, value // 3, 0), (column * cell_w, (rows - 1 - row) * cell_h, cell_w, cell_h))
+    top = rows * cell_h + 10
+    pygame.draw.rect(surface, (60, 60, 60), (0, top, segments * cell_w, plot_h), 1)
+    points = [(0, top)] + [((column + 1) * cell_w, top + (1 - value) * (plot_h - 1))
+                           for column, value in enumerate(survival)]
+    pygame.draw.lines(surface, (255, 255, 255), False, points)
+    pygame.image.save(surface, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="play seeded runs with the dodge bot and aggregate the damage")
+    parser.add_argument("--runs", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0, help="master seed the run seeds are drawn from")
+    parser.add_argument("--segment", type=float, default=1000, help="song segment length in ms")
+    parser.add_argument("--duration", type=float, default=scratch.SONG_LENGTH)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--output", default="montecarlo.json")
+    parser.add_argument("--image", default="montecarlo.png", help="damage heatmap and survival curve")
+    args = parser.parse_args()
+
+    master = random.Random(args.seed)
+    seeds = [master.getrandbits(63) for i in range(args.runs)]
+    start = time.perf_counter()
+    results = run_seeds(seeds, args.segment, args.duration, args.workers)
+    elapsed = time.perf_counter() - start
+
+    damage = np.stack([damage for damage, death in results])
+    deaths = [death for damage, death in results]
+    survival = survival_curve(deaths, damage.shape[1], args.segment)
+    print("%d runs on %d workers in %.1f s (%.2f runs per second)" % (len(seeds), args.workers, elapsed,
+                                                                      len(seeds) / elapsed))
+    print("survived the song: %.1f%%" % (survival[-1] * 100))
+    mean = damage.mean(0)
+    for column in np.argsort(mean)[::-1][:5].tolist():
+        print("  %6.0f-%-6.0f ms: %.2f damage per run" % (column * args.segment, (column + 1) * args.segment,
+                                                          mean[column]))
+
+    with open(args.output, "w") as file:
+        json.dump({"seed": args.seed, "runs": args.runs, "segment_ms": args.segment, "duration_ms": args.duration,
+                   "mean_damage": mean.tolist(), "survival": survival.tolist(), "deaths": deaths,
+                   "damage": damage.tolist()}, file)
+    save_image(args.image, damage, survival, args.segment)
+    print("wrote", args.output, "and", args.image)
+
+
+if __name__ == "__main__":
+    main()
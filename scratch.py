@@ -1,39 +1,114 @@
 import pygame
 import pygame.gfxdraw
+import argparse
+import copy
+import hashlib
+import heapq
+import itertools
+import json
 import math
+import numpy as np
+import os
+import pickle
+import queue
 import random
+import struct
+import threading
+import time
+import zlib
+from multiprocessing import resource_tracker, shared_memory
 
 START_TIME = 0
+SONG_LENGTH = 50000
 TMR_SPEED = 60
+SIM_STEP = 4
+MAX_FRAME_TIME = 250
 GLOBAL_TIMER = None
 OBJ_LIST = []
-BULLET_EVENTS = []
+# everyone the bullets can hit; the first is the keyboard's (or BOT's) player, the rest steer themselves
+PLAYERS = []
+PLAYER_COUNT = 1
 DIM_GREY = (119, 136, 153)
 
 INVINC_TIME = 1000
 BLINK_TIME = 100
 
+INPUT_LEFT = 1
+INPUT_RIGHT = 2
+INPUT_UP = 4
+INPUT_DOWN = 8
+INPUT_SLOW = 16
+
+REPLAY_MAGIC = b"AERP"
+REPLAY_VERSION = 1
+# magic, version, seed, step (ms), START_TIME (ms)
+REPLAY_HEADER = struct.Struct("<4sBQdd")
+REPLAY_END = 0xFF
+
+EXPORT_NAME = "aeternus_state"
+EXPORT_MAGIC = b"AEST"
+EXPORT_VERSION = 1
+# magic, version, ring slots, then the bullet, beam and player capacity of each slot; the number of the
+# newest finished tick follows as a uint64, and the slots start at EXPORT_SLOTS_OFFSET
+EXPORT_HEADER = struct.Struct("<4sBxxxIIII")
+EXPORT_LATEST_OFFSET = 24
+EXPORT_SLOTS_OFFSET = 64
+# each slot starts with one of these; sequence is odd while the slot is being written
+EXPORT_FRAME = np.dtype([("sequence", "<u8"), ("tick", "<u8"), ("time", "<f8"), ("bullets", "<u4"),
+                         ("beams", "<u4"), ("players", "<u4"), ("color", "u1", 3)], align=True)
+# followed by one column per field, each `capacity` long; velocities are in pixels per ms
+EXPORT_COLUMNS = {
+    "bullets": (("x", "<f4"), ("y", "<f4"), ("x_velocity", "<f4"), ("y_velocity", "<f4"), ("radius", "<f4"),
+                ("kind", "u1")),
+    "beams": (("x1", "<f4"), ("y1", "<f4"), ("x2", "<f4"), ("y2", "<f4"), ("cx", "<f4"), ("cy", "<f4"),
+              ("radius", "<f4"), ("width", "<i4"), ("kind", "u1"), ("held", "?")),
+    "players": (("x", "<f4"), ("y", "<f4"), ("radius", "<f4"), ("health", "<i4"), ("alive", "?"),
+                ("invincible", "?")),
+}
+
+rng = random.Random()
+RUN_SEED = 0
+RECORD_PATH = None
+RECORDER = None
+REPLAY = None
+BOT = None
+runs_started = 0
+TRACE_PATH = None
+# set with --telemetry: per-tick records are streamed to a file in the background
+TELEMETRY = None
+# set to a Framebuffer to draw with the NumPy software renderer instead of sprite blits
+FRAMEBUFFER = None
+# set with --threaded: the simulation runs on its own thread, a frame ahead of what is drawn
+WORKER = None
+# set with --export: each tick's state is published to shared memory for other local processes
+EXPORT = None
+
+# the song's events live in the chart file; it is compiled once per path
+CHART_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chart.json")
+CHARTS = {}
+
+# warm starts at START_TIME restore the nearest snapshot of an idle headless run with the same seed
+SNAPSHOT_INTERVAL = 1000
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "snapshot_cache")
+SNAPSHOT_GLOBALS = ("precision_x", "increasing_color")
+PRACTICE_SEED = 0
+# true while build_snapshots or warm_start steps the reference run, which has to be the same whatever the
+# command line: no bots, replays or extra players act in it, and nothing is recorded or exported
+REFERENCE_RUN = False
+
 increasing_color = True
 bullet_color = pygame.Color(255, 0, 0)
 
-sine_pos = 0
-offset = 0
-pentagram_offset = 0
-circle_2_offset = 0
-slow_hell_offset = 0
 precision_x = 0
 
-pygame.init()
-screen = pygame.display.set_mode((1000, 900), pygame.NOFRAME)
+# an offscreen surface until init_display() swaps in the window, so the simulation can run without one
+screen = pygame.Surface((1000, 900))
 clock = pygame.time.Clock()
 running = True
 
 death_surface = pygame.Surface((screen.get_width(), screen.get_height()))
 death_surface.set_alpha(100)
 
-circular_beam_surface = pygame.Surface((screen.get_width(), screen.get_height()), pygame.SRCALPHA)
-circular_beam_surface.set_alpha(100)
-
 
 class Circle:
     def __init__(self, x, y, radius):
@@ -58,7 +133,10 @@ class GameObject:
 
     def __init__(self, circ):
         OBJ_LIST.append(self)
+        self.alive = True
         self.circ = circ
+        self.prev_x = circ.x
+        self.prev_y = circ.y
         self.color = None
         self.drawing = True
         self.width = 0
@@ -80,14 +158,29 @@ class GameObject:
         self.circ.set_position(x, y)
 
     def kill(self):
-        if self in OBJ_LIST:
-            OBJ_LIST.remove(self)
+        self.alive = False
 
     def update(self, dt):
+        self.prev_x = self.get_x()
+        self.prev_y = self.get_y()
         self.time_since += dt
 
-    def draw(self):
-        pygame.draw.circle(screen, self.color, (self.get_x(), self.get_y()), self.get_radius(), self.width)
+    def draw_position(self, alpha=1):
+        return self.prev_x + (self.get_x() - self.prev_x) * alpha, self.prev_y + (self.get_y() - self.prev_y) * alpha
+
+    def bounds(self, alpha=1):
+        x, y = self.draw_position(alpha)
+        radius = self.get_radius() + 1
+        return x - radius, y - radius, x + radius, y + radius
+
+    def frozen(self):
+        # a copy to draw from that later moves don't reach
+        frozen = copy.copy(self)
+        frozen.circ = copy.copy(self.circ)
+        return frozen
+
+    def draw(self, alpha=1):
+        pygame.draw.circle(screen, self.color, self.draw_position(alpha), self.get_radius(), self.width)
 
     def on_col(self):
         pass
@@ -106,9 +199,12 @@ class Player(GameObject):
         self.speed = 5 * TMR_SPEED / 1000
         self.invinc = INVINC_TIME
         self.health = 20
+        self.bot = None
 
     def update(self, dt):
         global TMR_SPEED
+        self.prev_x = self.get_x()
+        self.prev_y = self.get_y()
         last_invinc = self.invinc
         self.invinc += dt
         if self.invinc < INVINC_TIME and self.invinc % BLINK_TIME < last_invinc % BLINK_TIME:
@@ -132,6 +228,17 @@ class Player(GameObject):
         if self.down:
             self.move(0, speed)
 
+    def get_input_bits(self):
+        return (self.left * INPUT_LEFT | self.right * INPUT_RIGHT | self.up * INPUT_UP | self.down * INPUT_DOWN |
+                self.slowed * INPUT_SLOW)
+
+    def set_input_bits(self, bits):
+        self.left = bits & INPUT_LEFT != 0
+        self.right = bits & INPUT_RIGHT != 0
+        self.up = bits & INPUT_UP != 0
+        self.down = bits & INPUT_DOWN != 0
+        self.slowed = bits & INPUT_SLOW != 0
+
     def move(self, dx, dy):
         bounds = self.circ
         if bounds.x + bounds.radius + dx > screen.get_width():
@@ -154,28 +261,1316 @@ class Player(GameObject):
             self.kill()
 
 
-class Bullet(GameObject):
+HOMING = 1
+BOUNCING = 2
+CIRCULAR = 4
+SINUSOIDAL = 8
+# kinds whose motion depends on the player or the screen edges; everything else is a closed-form function of time
+INTEGRATED = HOMING | BOUNCING
+MIN_ORBIT = 0.01
+
+
+def unit_vector(x, y):
+    # (1, 0) for a zero vector, as cos/sin of atan2(0, 0) would give
+    length = np.hypot(x, y)
+    nonzero = length > 0
+    length = np.where(nonzero, length, 1)
+    return np.where(nonzero, x / length, 1), np.where(nonzero, y / length, 0)
+
+
+def leave_time(position, velocity, low, high):
+    # how long position + velocity * t takes to get outside [low, high]; -inf if it already is
+    moving = velocity != 0
+    safe = np.where(moving, velocity, 1)
+    t = np.where(velocity > 0, (high - position) / safe, np.where(moving, (low - position) / safe, np.inf))
+    return np.where((position < low) | (position > high), -np.inf, t)
+
+
+def expand(start, count):
+    # start[i], start[i] + 1, ... for count[i] values each, and the index i each value came from
+    count = np.maximum(count, 0)
+    owner = np.repeat(np.arange(len(count)), count)
+    first = np.cumsum(count) - count
+    return start[owner] + np.arange(len(owner)) - first[owner], owner
+
+
+def group(owner, values, n):
+    # values split into n arrays by owner, keeping their order within each
+    order = np.argsort(owner, kind="stable")
+    return np.split(values[order], np.cumsum(np.bincount(owner, minlength=n))[:-1])
+
+
+def point_segment_distance(px, py, x1, y1, x2, y2):
+    # clamp the projection of the point onto each segment
+    dx = x2 - x1
+    dy = y2 - y1
+    length = dx * dx + dy * dy
+    t = np.clip(((px - x1) * dx + (py - y1) * dy) / np.where(length > 0, length, 1), 0, 1)
+    return np.hypot(x1 + t * dx - px, y1 + t * dy - py)
+
+
+def segment_distance(ax1, ay1, ax2, ay2, bx1, by1, bx2, by2):
+    # segments that cross are 0 apart, otherwise the closest pair always involves an endpoint
+    def side(x1, y1, x2, y2, px, py):
+        return np.sign((x2 - x1) * (py - y1) - (y2 - y1) * (px - x1))
+    crossing = ((side(ax1, ay1, ax2, ay2, bx1, by1) * side(ax1, ay1, ax2, ay2, bx2, by2) < 0) &
+                (side(bx1, by1, bx2, by2, ax1, ay1) * side(bx1, by1, bx2, by2, ax2, ay2) < 0))
+    dist = np.minimum(np.minimum(point_segment_distance(ax1, ay1, bx1, by1, bx2, by2),
+                                 point_segment_distance(ax2, ay2, bx1, by1, bx2, by2)),
+                      np.minimum(point_segment_distance(bx1, by1, ax1, ay1, ax2, ay2),
+                                 point_segment_distance(bx2, by2, ax1, ay1, ax2, ay2)))
+    return np.where(crossing, 0, dist)
+
+
+class SpatialGrid:
+    # uniform grid over the playfield; bullets are bucketed by cell so a query only touches nearby slots
     def __init__(self):
-        super().__init__(Circle(0, 0, 6))
-        self.x_speed = 0
-        self.y_speed = 0
-        self.speed = TMR_SPEED / 1000
-        self.increasing_color = True
-        self.survive_off_screen = False
+        self.cell_size = 12
+        self.max_radius = 0
+        self.max_travel = 0
+        self.cols = 0
+        self.rows = 0
+        self.order = np.zeros(0, np.intp)
+        self.starts = np.zeros(1, np.intp)
+
+    def rebuild(self, x, y, prev_x, prev_y, radius, alive, width, height, cell_size=None):
+        # bullets that stayed off the playfield over the last step can't have touched anything on it
+        near = (np.maximum(x, prev_x) + radius >= 0) & (np.minimum(x, prev_x) - radius <= width)
+        near &= (np.maximum(y, prev_y) + radius >= 0) & (np.minimum(y, prev_y) - radius <= height)
+        live = np.flatnonzero(alive & near)
+        self.max_radius = radius[live].max() if len(live) > 0 else 0
+        self.max_travel = np.hypot(x[live] - prev_x[live], y[live] - prev_y[live]).max() if len(live) > 0 else 0
+        self.cell_size = cell_size or max(2 * self.max_radius, 1)
+        self.cols = int(width // self.cell_size) + 1
+        self.rows = int(height // self.cell_size) + 1
+        cells = self.cell_of(x[live], y[live])
+        order = np.argsort(cells, kind="stable")
+        self.order = live[order]
+        self.starts = np.zeros(self.cols * self.rows + 1, np.intp)
+        np.cumsum(np.bincount(cells, minlength=self.cols * self.rows), out=self.starts[1:])
+
+    def cell_of(self, x, y):
+        col = np.clip((x // self.cell_size).astype(np.intp), 0, self.cols - 1)
+        row = np.clip((y // self.cell_size).astype(np.intp), 0, self.rows - 1)
+        return row * self.cols + col
+
+    def query(self, x, y, radius):
+        # anything that could have passed within radius of each circle during the last step, as (circle, slot)
+        # pairs. Each circle reads one contiguous run of the sorted order per row of its query box, since
+        # cells are row-major, so the cost is the number of candidates rather than circles times slots
+        reach = radius + self.max_radius + self.max_travel
+        col1 = np.clip(((x - reach) // self.cell_size).astype(np.intp), 0, self.cols - 1)
+        col2 = np.clip(((x + reach) // self.cell_size).astype(np.intp), 0, self.cols - 1)
+        row1 = np.clip(((y - reach) // self.cell_size).astype(np.intp), 0, self.rows - 1)
+        row2 = np.clip(((y + reach) // self.cell_size).astype(np.intp), 0, self.rows - 1)
+        row, circle = expand(row1, row2 - row1 + 1)
+        first = self.starts[row * self.cols + col1[circle]]
+        last = self.starts[row * self.cols + col2[circle] + 1]
+        index, run = expand(first, last - first)
+        return circle[run], self.order[index]
+
+    def query_one(self, x, y, radius):
+        # query() for a single circle, as slots, without the bookkeeping of pairing candidates to circles
+        reach = radius + self.max_radius + self.max_travel
+        col1 = min(max(int((x - reach) // self.cell_size), 0), self.cols - 1)
+        col2 = min(max(int((x + reach) // self.cell_size), 0), self.cols - 1)
+        row1 = min(max(int((y - reach) // self.cell_size), 0), self.rows - 1)
+        row2 = min(max(int((y + reach) // self.cell_size), 0), self.rows - 1)
+        runs = [self.order[self.starts[row * self.cols + col1]:self.starts[row * self.cols + col2 + 1]]
+                for row in range(row1, row2 + 1)]
+        return np.concatenate(runs) if runs else self.order[:0]
+
+
+def nearest(x, y, target_x, target_y, width, height):
+    # index of the closest target to each point. Targets are bucketed about one to a cell, so a point only
+    # measures those within a cell of it; if none is that close a nearer one could lie beyond the query, so
+    # those few points are measured against every target
+    best = np.zeros(len(x), np.intp)
+    count = len(target_x)
+    if count == 1 or len(x) == 0:
+        return best
+    if count * len(x) <= 1 << 16:
+        # small enough that bucketing costs more than measuring everything
+        return np.argmin(np.hypot(target_x - x[:, None], target_y - y[:, None]), 1)
+    grid = SpatialGrid()
+    grid.rebuild(target_x, target_y, target_x, target_y, np.zeros(count), np.ones(count, bool), width, height,
+                 max(math.sqrt(width * height / count), 1))
+    point, target = grid.query(x, y, np.full(len(x), grid.cell_size))
+    dist = np.hypot(target_x[target] - x[point], target_y[target] - y[point])
+    order = np.lexsort((dist, point))
+    point = point[order]
+    first = np.flatnonzero(np.diff(point, prepend=-1) != 0)
+    best[point[first]] = target[order[first]]
+    missed = np.ones(len(x), bool)
+    missed[point[first][dist[order[first]] <= grid.cell_size]] = False
+    missed = np.flatnonzero(missed)
+    if len(missed):
+        best[missed] = np.argmin(np.hypot(target_x - x[missed, None], target_y - y[missed, None]), 1)
+    return best
+
+
+class SpriteCache:
+    # pre-rendered anti-aliased discs keyed on (radius, colour); colours unused for max_age frames are evicted.
+    # the edges are blended against the black background and keyed out, which blits far faster than per-pixel alpha
+    def __init__(self, max_age=120):
+        self.max_age = max_age
+        self.frame = 0
+        self.sprites = {}
+        self.last_used = {}
+
+    def get(self, radius, color):
+        key = (radius, tuple(color))
+        sprite = self.sprites.get(key)
+        if sprite is None:
+            sprite = pygame.Surface((2 * radius + 1, 2 * radius + 1))
+            pygame.gfxdraw.filled_circle(sprite, radius, radius, radius, color)
+            pygame.gfxdraw.aacircle(sprite, radius, radius, radius, color)
+            if pygame.display.get_surface() is not None:
+                sprite = sprite.convert()
+            sprite.set_colorkey((0, 0, 0), pygame.RLEACCEL)
+            self.sprites[key] = sprite
+        self.last_used[key] = self.frame
+        return sprite
+
+    def end_frame(self):
+        self.frame += 1
+        for key, frame in list(self.last_used.items()):
+            if self.frame - frame > self.max_age:
+                del self.sprites[key]
+                del self.last_used[key]
+
+
+SPRITES = SpriteCache()
+
+
+class BeamOverlay:
+    # translucent layer for filled and reverse circular beams, drawn with the blend alpha baked into each
+    # pixel so that overlapping circles still blend once. Only the regions under this frame's circles are
+    # cleared and blended, and nothing happens without any. A reverse beam tints everything outside it, so
+    # only the last one drawn counts
+    def __init__(self, width, height, alpha=100):
+        self.surface = pygame.Surface((width, height), pygame.SRCALPHA)
+        self.alpha = alpha
+        self.discs = []
+        self.reverse = None
+
+    def add(self, center, radius, color, reverse=False):
+        if reverse:
+            self.reverse = center, radius, color
+            self.discs = []
+        else:
+            self.discs.append((center, radius, color))
+
+    def regions(self):
+        # disc bounds merged until none overlap, so no pixel is blended twice
+        bounds = self.surface.get_rect()
+        rects = []
+        for (x, y), radius, color in self.discs:
+            rect = pygame.Rect(0, 0, 2 * radius + 2, 2 * radius + 2)
+            rect.center = round(x), round(y)
+            rect = rect.clip(bounds)
+            while True:
+                overlap = rect.collidelist(rects)
+                if overlap < 0:
+                    break
+                rect.union_ip(rects.pop(overlap))
+            if rect.width and rect.height:
+                rects.append(rect)
+        return rects
+
+    def composite(self, target):
+        if self.reverse is None and not self.discs:
+            return
+        surface = self.surface
+        if self.reverse is not None:
+            center, radius, color = self.reverse
+            regions = [surface.get_rect()]
+            surface.fill((*color[:3], self.alpha))
+            pygame.draw.circle(surface, (0, 0, 0, 0), center, radius)
+        else:
+            regions = self.regions()
+            for rect in regions:
+                surface.fill((0, 0, 0, 0), rect)
+        for center, radius, color in self.discs:
+            pygame.draw.circle(surface, (*color[:3], self.alpha), center, radius)
+        for rect in regions:
+            target.blit(surface, rect, rect)
+        self.discs = []
+        self.reverse = None
+
+
+class DirtyTracker:
+    # coarse tile mask of everything drawn last frame and this frame; only those tiles are cleared and flipped
+    def __init__(self, width, height, tile=50, full_ratio=0.5):
+        self.width = width
+        self.height = height
+        self.tile = tile
+        self.full_ratio = full_ratio
+        self.cols = -(-width // tile)
+        self.rows = -(-height // tile)
+        self.previous = np.ones((self.rows, self.cols), np.bool_)
+        self.corners = np.zeros((self.rows + 1) * (self.cols + 1), np.int64)
+
+    def mark(self, x1, y1, x2, y2):
+        # boxes go into a 2D difference array, so each costs four increments however many tiles it spans
+        x1, y1, x2, y2 = np.broadcast_arrays(*(np.atleast_1d(v) for v in (x1, y1, x2, y2)))
+        visible = (x2 > 0) & (y2 > 0) & (x1 < self.width) & (y1 < self.height)
+        col1 = np.clip(x1[visible] // self.tile, 0, self.cols - 1).astype(np.intp)
+        row1 = np.clip(y1[visible] // self.tile, 0, self.rows - 1).astype(np.intp)
+        col2 = np.clip((x2[visible] - 1) // self.tile, 0, self.cols - 1).astype(np.intp) + 1
+        row2 = np.clip((y2[visible] - 1) // self.tile, 0, self.rows - 1).astype(np.intp) + 1
+        stride = self.cols + 1
+        size = len(self.corners)
+        self.corners += np.bincount(np.concatenate((row1 * stride + col1, row2 * stride + col2)), minlength=size)
+        self.corners -= np.bincount(np.concatenate((row1 * stride + col2, row2 * stride + col1)), minlength=size)
+
+    def mark_line(self, x1, y1, x2, y2, width):
+        # boxes around points spaced half a tile apart, padded so the line between them stays covered
+        spacing = self.tile / 2
+        steps = int(math.hypot(x2 - x1, y2 - y1) // spacing) + 2
+        x = np.linspace(x1, x2, steps)
+        y = np.linspace(y1, y2, steps)
+        pad = width / 2 + spacing / 2 + 1
+        self.mark(x - pad, y - pad, x + pad, y + pad)
+
+    def invalidate(self):
+        self.previous[:] = True
+
+    def rects(self):
+        corners = self.corners.reshape(self.rows + 1, self.cols + 1)
+        current = corners.cumsum(0).cumsum(1)[:-1, :-1] > 0
+        dirty = current | self.previous
+        self.previous = current
+        self.corners[:] = 0
+        if dirty.mean() > self.full_ratio:
+            return None
+        rects = []
+        for row in np.flatnonzero(dirty.any(1)).tolist():
+            edges = np.flatnonzero(np.diff(np.concatenate(([0], dirty[row].astype(np.int8), [0]))))
+            for start, end in zip(edges[::2].tolist(), edges[1::2].tolist()):
+                rects.append(pygame.Rect(start * self.tile, row * self.tile, (end - start) * self.tile, self.tile))
+        return rects
+
+
+DIRTY = DirtyTracker(screen.get_width(), screen.get_height())
+BEAM_OVERLAY = BeamOverlay(screen.get_width(), screen.get_height())
+
+
+class Framebuffer:
+    # software renderer for bullet counts the sprite blits can't keep up with. Bullets are splatted into a
+    # coverage array through precomputed disc masks, beams are rasterised as runs of pixels, and the frame
+    # goes out in a single blit_array. Arrays are indexed (x, y) like surfarray and hold mapped colours
+    def __init__(self, width, height, overlay_alpha=100):
+        self.width = width
+        self.height = height
+        self.overlay_alpha = overlay_alpha
+        self.frame = np.zeros((width, height), np.uint32)
+        self.overlay = np.zeros((width, height), np.uint32)
+        self.covered = np.zeros((width, height), np.bool_)
+        # x1, y1, x2, y2 of what the overlay covers this frame, or None
+        self.overlay_box = None
+        self.pad = 0
+        self.coverage = None
+        self.masks = {}
+        self.spans = {}
+        self.max_spans = 256
+        self.format = None
+        self.reserve(16)
+
+    def reserve(self, radius):
+        # coverage is padded by the largest radius drawn so far, so discs over the edges need no clipping
+        if radius <= self.pad:
+            return
+        self.pad = max(radius, 2 * self.pad)
+        self.coverage = np.zeros((self.width + 2 * self.pad, self.height + 2 * self.pad), np.uint8)
+        self.masks = {}
+
+    def mask(self, radius):
+        # flat offsets and coverage of an anti-aliased disc, weakest first, so that where discs overlap the
+        # strongest write lands last
+        mask = self.masks.get(radius)
+        if mask is None:
+            dx, dy = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+            weight = np.clip(radius + 0.5 - np.hypot(dx, dy), 0, 1)
+            inside = weight > 0
+            order = np.argsort(weight[inside], kind="stable")
+            offsets = (dx[inside] * self.coverage.shape[1] + dy[inside])[order]
+            mask = offsets.tolist(), np.round(weight[inside][order] * 255).astype(np.uint8).tolist()
+            self.masks[radius] = mask
+        return mask
+
+    def map(self, r, g, b):
+        pixels = np.uint32(0)
+        for channel, mask, shift, loss in zip((r, g, b), *self.format):
+            pixels = pixels | np.asarray(channel).astype(np.uint32) >> loss << shift
+        return pixels
+
+    def unmap(self, pixels):
+        return [(pixels & mask) >> shift << loss for mask, shift, loss in zip(*self.format)]
+
+    def render(self, surface, bullets, beams, color, alpha=1, rewind=0):
+        self.format = surface.get_masks()[:3], surface.get_shifts()[:3], surface.get_losses()[:3]
+        self.coverage.fill(0)
+        if self.overlay_box is not None:
+            x1, y1, x2, y2 = self.overlay_box
+            self.covered[x1:x2, y1:y2] = False
+            self.overlay_box = None
+        self.draw_bullets(bullets, alpha)
+        pad = self.pad
+        shade = np.arange(256, dtype=np.uint32)
+        lut = self.map(shade * color[0] // 255, shade * color[1] // 255, shade * color[2] // 255)
+        np.take(lut, self.coverage[pad:pad + self.width, pad:pad + self.height], out=self.frame)
+        self.draw_beams(beams, color, rewind)
+        if self.overlay_box is not None:
+            self.blend()
+        pygame.surfarray.blit_array(surface, self.frame)
+
+    def draw_bullets(self, bullets, alpha=1):
+        x, y, radius = bullets.sprite_positions(alpha)
+        x += radius
+        y += radius
+        visible = (x + radius >= 0) & (x - radius < self.width) & (y + radius >= 0) & (y - radius < self.height)
+        x, y, radius = x[visible], y[visible], radius[visible]
+        if len(radius) == 0:
+            return
+        self.reserve(int(radius.max()))
+        coverage = self.coverage.reshape(-1)
+        centres = (x + self.pad) * self.coverage.shape[1] + y + self.pad
+        for r in np.flatnonzero(np.bincount(radius)).tolist():
+            # sorted, so each pass over the mask writes through memory in order
+            same = np.sort(centres[radius == r])
+            for offset, weight in zip(*self.mask(r)):
+                coverage[same + offset] = weight
+
+    def paint(self, x, y, colors):
+        # beams go under the bullets, so only pixels no bullet covers are painted, as with colour-keyed sprites
+        free = self.coverage[x + self.pad, y + self.pad] == 0
+        self.frame[x[free], y[free]] = colors[free]
+
+    def draw_beams(self, beams, color, rewind=0):
+        live = beams.live()
+        if len(live) == 0:
+            return
+        kind = beams.kind[live]
+        colors = np.where(beams.dim[live], self.map(*DIM_GREY), self.map(*tuple(color)[:3]))
+        radius = beams.radius[live] - beams.radius_increment[live] * rewind
+        circular = kind & BEAM_CIRCULAR != 0
+
+        lines = np.flatnonzero(~circular)
+        slots = live[lines]
+        dx = beams.x_speed[slots] * beams.speed[slots] * rewind
+        dy = beams.y_speed[slots] * beams.speed[slots] * rewind
+        x, y, owner = self.line_pixels(beams.x1[slots] - dx, beams.y1[slots] - dy, beams.x2[slots] - dx,
+                                       beams.y2[slots] - dy, beams.width[slots])
+        self.paint(x, y, colors[lines][owner])
+
+        rings = np.flatnonzero(circular & (kind & BEAM_REVERSE == 0) & ~beams.damage_within[live])
+        slots = live[rings]
+        x, y, owner = self.circle_pixels(beams.cx[slots], beams.cy[slots], radius[rings], beams.width[slots])
+        self.paint(x, y, colors[rings][owner])
+
+        # filled and reverse circles go on the translucent overlay, in slot order like the sprite path
+        for i in np.flatnonzero(circular & ((kind & BEAM_REVERSE != 0) | beams.damage_within[live])).tolist():
+            slot = live[i]
+            x, y = self.circle_pixels(beams.cx[slot:slot + 1], beams.cy[slot:slot + 1], radius[i:i + 1])[:2]
+            if kind[i] & BEAM_REVERSE:
+                self.overlay.fill(colors[i])
+                self.covered.fill(True)
+                self.covered[x, y] = False
+                self.overlay_box = 0, 0, self.width, self.height
+            elif len(x):
+                self.overlay[x, y] = colors[i]
+                self.covered[x, y] = True
+                box = x.min(), y.min(), x.max() + 1, y.max() + 1
+                if self.overlay_box is not None:
+                    box = (min(box[0], self.overlay_box[0]), min(box[1], self.overlay_box[1]),
+                           max(box[2], self.overlay_box[2]), max(box[3], self.overlay_box[3]))
+                self.overlay_box = box
+
+    def line_pixels(self, x1, y1, x2, y2, width):
+        # a run of width pixels across the line for every pixel along its major axis, only over the part of
+        # the line that can touch the screen
+        steep = np.abs(y2 - y1) > np.abs(x2 - x1)
+        u1, u2 = np.where(steep, y1, x1), np.where(steep, y2, x2)
+        v1, v2 = np.where(steep, x1, y1), np.where(steep, x2, y2)
+        u_limit = np.where(steep, self.height, self.width)
+        v_limit = np.where(steep, self.width, self.height)
+        span = u2 - u1
+        slope = (v2 - v1) / np.where(span != 0, span, 1)
+        lo = np.maximum(np.ceil(np.minimum(u1, u2)), 0)
+        hi = np.minimum(np.floor(np.maximum(u1, u2)), u_limit - 1)
+        # and where the minor axis is on screen
+        sloped = slope != 0
+        safe_slope = np.where(sloped, slope, 1)
+        enter = u1 + (-width - v1) / safe_slope
+        leave = u1 + (v_limit + width - v1) / safe_slope
+        lo = np.where(sloped, np.maximum(lo, np.ceil(np.minimum(enter, leave))), lo)
+        hi = np.where(sloped, np.minimum(hi, np.floor(np.maximum(enter, leave))), hi)
+        hi = np.where(~sloped & ((v1 < -width) | (v1 > v_limit + width)), lo - 1, hi)
+
+        lo = lo.astype(np.intp)
+        u, owner = expand(lo, hi.astype(np.intp) - lo + 1)
+        v = np.round(v1[owner] + slope[owner] * (u - u1[owner])).astype(np.intp) - width[owner] // 2
+        v, step = expand(v, width[owner])
+        u = u[step]
+        owner = owner[step]
+        on_screen = (v >= 0) & (v < v_limit[owner])
+        u, v, owner = u[on_screen], v[on_screen], owner[on_screen]
+        steep = steep[owner]
+        return np.where(steep, v, u), np.where(steep, u, v), owner
+
+    def circle_spans(self, radius, width=0):
+        # column spans of a circle of whole-pixel radius around the origin, or of a ring width pixels thick,
+        # which has two in the columns through its hole. Cached, so beams that keep their radius only pay
+        # for clipping them
+        key = radius, width
+        spans = self.spans.get(key)
+        if spans is None:
+            if len(self.spans) >= self.max_spans:
+                del self.spans[next(iter(self.spans))]
+            dx = np.arange(-radius, radius + 1)
+            outer = np.floor(np.sqrt(np.maximum(radius * radius - dx * dx, 0))).astype(np.intp)
+            if width:
+                hole = radius - width
+                inner = np.where(np.abs(dx) < hole, np.ceil(np.sqrt(np.maximum(hole * hole - dx * dx, 0))), -1)
+                inner = inner.astype(np.intp)
+                spans = (np.concatenate((dx, dx)), np.concatenate((-outer, inner + 1)),
+                         np.concatenate((-inner - 1, outer)))
+            else:
+                spans = dx, -outer, outer
+            self.spans[key] = spans
+        return spans
+
+    def circle_pixels(self, cx, cy, radius, width=None):
+        columns, tops, bottoms, owners = [], [], [], []
+        centres = zip(np.round(cx).astype(np.intp).tolist(), np.round(cy).astype(np.intp).tolist(),
+                      np.round(radius).astype(np.intp).tolist())
+        for i, (x, y, r) in enumerate(centres):
+            dx, top, bottom = self.circle_spans(r, 0 if width is None else int(width[i]))
+            columns.append(dx + x)
+            tops.append(top + y)
+            bottoms.append(bottom + y)
+            owners.append(np.full(len(dx), i))
+        if not columns:
+            empty = np.zeros(0, np.intp)
+            return empty, empty, empty
+        x = np.concatenate(columns)
+        on_screen = (x >= 0) & (x < self.width)
+        x = x[on_screen]
+        owner = np.concatenate(owners)[on_screen]
+        top = np.maximum(np.concatenate(tops)[on_screen], 0)
+        bottom = np.minimum(np.concatenate(bottoms)[on_screen], self.height - 1)
+        y, span = expand(top, bottom - top + 1)
+        return x[span], y, owner[span]
+
+    def blend(self):
+        x1, y1, x2, y2 = self.overlay_box
+        frame = self.frame[x1:x2, y1:y2]
+        covered = self.covered[x1:x2, y1:y2]
+        below = self.unmap(frame[covered].astype(np.int64))
+        above = self.unmap(self.overlay[x1:x2, y1:y2][covered].astype(np.int64))
+        frame[covered] = self.map(*(b + (a - b) * self.overlay_alpha // 255 for a, b in zip(above, below)))
+
+
+PHASE_INPUT, PHASE_EVENTS, PHASE_UPDATE, PHASE_COLLISION, PHASE_DRAW, PHASE_HUD, PHASE_DISPLAY, PHASE_IDLE = range(8)
+PHASE_NAMES = ("input", "events", "update", "collision", "draw", "hud", "display", "idle")
+PHASE_COLORS = ((200, 200, 200), (255, 160, 0), (0, 160, 255), (255, 60, 60),
+                (60, 220, 60), (200, 0, 200), (255, 255, 0), (70, 70, 70))
+
+
+class Profiler:
+    # splits each frame into phases with lap() calls; both lap() and end_frame() return straight away while
+    # neither the overlay, a trace nor telemetry is on, so the instrumentation can stay in the loop
+    def __init__(self, history=240, graph_height=80, refresh=10):
+        self.enabled = False
+        self.visible = False
+        self.history = history
+        self.graph_height = graph_height
+        self.refresh = refresh
+        self.times = np.zeros((history, len(PHASE_NAMES)))
+        self.narrow_tests = np.zeros(history)
+        self.narrow_seen = 0
+        self.frames = 0
+        self.current = [0.0] * len(PHASE_NAMES)
+        self.last = 0
+        self.frame_start = 0
+        self.trace = None
+        self.trace_start = 0
+        self.recording = False
+        self.font = None
+        self.text = []
+        self.legend = []
+        self.width = history + 10
+        self.graph = None
+        # phases are timed on the thread that made the profiler; laps from a simulation worker are ignored
+        self.thread = threading.get_ident()
+        # the RenderState being drawn while a worker simulates; object counts come from it, since the live
+        # world is changing under the worker
+        self.state = None
+
+    def update_enabled(self):
+        enabled = self.visible or self.trace is not None or self.recording
+        if enabled and not self.enabled:
+            self.last = self.frame_start = time.perf_counter()
+            self.current = [0.0] * len(PHASE_NAMES)
+            self.narrow_seen = self.world()[1].narrow_tests
+        self.enabled = enabled
+
+    def toggle(self):
+        self.visible = not self.visible
+        self.update_enabled()
+        DIRTY.invalidate()
+
+    def start_trace(self):
+        self.trace = []
+        self.trace_start = time.perf_counter()
+        self.update_enabled()
+
+    def stop_trace(self):
+        self.trace = None
+        self.update_enabled()
+
+    def save_trace(self, path):
+        # Chrome trace-event format: open in chrome://tracing or ui.perfetto.dev
+        events = []
+        for name, start, end, args in self.trace:
+            event = {"name": name, "ph": "X", "pid": 0, "tid": 0,
+                     "ts": (start - self.trace_start) * 1e6, "dur": (end - start) * 1e6}
+            if args:
+                event["args"] = args
+                events.append({"name": "objects", "ph": "C", "pid": 0, "tid": 0, "ts": event["ts"], "args": args})
+            events.append(event)
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+        print("wrote %d trace events to %s" % (len(events), path))
+
+    def lap(self, phase):
+        if not self.enabled or threading.get_ident() != self.thread:
+            return
+        now = time.perf_counter()
+        self.current[phase] += now - self.last
+        if self.trace is not None:
+            self.trace.append((PHASE_NAMES[phase], self.last, now, None))
+        self.last = now
+
+    def end_frame(self):
+        if not self.enabled:
+            return
+        self.lap(PHASE_IDLE)
+        self.times[self.frames % self.history] = self.current
+        objects, bullets, beams = self.world()
+        # a store swapped for a fresh one starts counting from zero again
+        tests = bullets.narrow_tests - (self.narrow_seen if bullets.narrow_tests >= self.narrow_seen else 0)
+        self.narrow_seen = bullets.narrow_tests
+        self.narrow_tests[self.frames % self.history] = tests
+        if self.trace is not None:
+            counts = {"bullets": bullets.live_count(), "beams": beams.live_count(), "objects": len(objects),
+                      "narrow_tests": tests}
+            self.trace.append(("frame %d" % self.frames, self.frame_start, self.last, counts))
+        if self.graph is not None:
+            self.add_column(self.current)
+        self.frames += 1
+        self.current = [0.0] * len(PHASE_NAMES)
+        self.frame_start = self.last
+
+    def world(self):
+        if self.state is None:
+            return OBJ_LIST, BULLETS, BEAMS
+        return self.state.objects, self.state.bullets, self.state.beams
+
+    def object_counts(self):
+        objects, bullets, beams = self.world()
+        counts = {}
+        for obj in objects:
+            name = type(obj).__name__
+            counts[name] = counts.get(name, 0) + 1
+        for store, classes in ((bullets, (Bullet, HomingBullet, BouncingBullet, HomingBouncingBullet,
+                                          CircularBullet, SinusoidalBullet)),
+                               (beams, (Beam, MovingBeam, CircularBeam, ReverseCircularBeam))):
+            kinds = np.bincount(store.kind[store.live()], minlength=256)
+            for cls in classes:
+                if kinds[cls.kind]:
+                    counts[cls.__name__] = int(kinds[cls.kind])
+        return counts
+
+    def scale(self):
+        # the graph spans two frame budgets; the line across it marks one
+        return self.graph_height / (2000 / TMR_SPEED)
+
+    def add_column(self, times):
+        self.graph.scroll(-1, 0)
+        x = self.history - 1
+        self.graph.fill((0, 0, 0), (x, 0, 1, self.graph_height))
+        bottom = self.graph_height
+        for phase, seconds in enumerate(times):
+            height = seconds * 1000 * self.scale()
+            top = max(bottom - height, 0)
+            if bottom - top >= 0.5:
+                self.graph.fill(PHASE_COLORS[phase], (x, round(top), 1, round(bottom) - round(top)))
+            bottom = top
+        self.graph.set_at((x, self.graph_height // 2), (255, 255, 255))
+
+    def bounds(self):
+        return 0, 0, self.width, self.graph_height + 10 + 16 * (len(self.text) + 1)
+
+    def refresh_text(self):
+        filled = min(self.frames, self.history)
+        lines = []
+        if filled:
+            frame_ms = self.times[:filled].sum(1) * 1000
+            p50, p95, p99 = np.percentile(frame_ms, (50, 95, 99))
+            lines.append("%.1f fps   p50 %.1f  p95 %.1f  p99 %.1f ms" % (clock.get_fps(), p50, p95, p99))
+            means = self.times[:filled].mean(0) * 1000
+            lines.append("  ".join("%s %.1f" % (name, ms) for name, ms in zip(PHASE_NAMES, means) if name != "idle"))
+            lines.append("narrow-phase tests %.0f per frame" % self.narrow_tests[:filled].mean())
+        counts = self.object_counts()
+        names = sorted(counts)
+        for i in range(0, len(names), 3):
+            lines.append("  ".join("%s %d" % (name, counts[name]) for name in names[i:i + 3]))
+        self.text = [self.font.render(line, True, (255, 255, 255)) for line in lines]
+        self.legend = [(self.font.render(name, True, color), color) for name, color in zip(PHASE_NAMES, PHASE_COLORS)]
+        legend_width = sum(text.get_width() + 16 for text, color in self.legend)
+        self.width = max([self.history, legend_width] + [text.get_width() for text in self.text]) + 10
+
+    def draw(self, surface):
+        if self.font is None:
+            pygame.font.init()
+            self.font = pygame.font.Font(None, 18)
+            self.graph = pygame.Surface((self.history, self.graph_height))
+        if self.frames % self.refresh == 0 or not self.text:
+            self.refresh_text()
+        surface.fill((0, 0, 0), self.bounds())
+        y = 5
+        for text in self.text:
+            surface.blit(text, (5, y))
+            y += 16
+        x = 5
+        for text, color in self.legend:
+            surface.fill(color, (x, y + 3, 8, 8))
+            surface.blit(text, (x + 10, y))
+            x += text.get_width() + 16
+        surface.blit(self.graph, (5, y + 16))
+
+
+PROFILER = Profiler()
+
+TELEMETRY_MAGIC = b"AETL"
+TELEMETRY_VERSION = 1
+# magic, version, then the length of the JSON record layout that follows; chunks come after it
+TELEMETRY_HEADER = struct.Struct("<4sBI")
+# rows in the chunk, then per column of the record the length of its zlib-compressed bytes and the bytes
+TELEMETRY_CHUNK = struct.Struct("<I")
+# phase timings are those of the last frame finished before the tick, in ms
+TELEMETRY_RECORD = np.dtype([("run", "<u4"), ("time", "<f8"), ("bullets", "<u4"), ("beams", "<u4"),
+                             ("x", "<f4"), ("y", "<f4"), ("health", "<i4"), ("frame", "<u8")] +
+                            [(name + "_ms", "<f4") for name in PHASE_NAMES])
+
+
+class Telemetry:
+    # per-tick records go into a fixed ring; whenever a chunk of it fills, a writer thread compresses it
+    # column by column and appends it to the file. record() never waits on the writer: if the writer falls a
+    # whole ring behind, new records are dropped and counted instead, so memory stays fixed however long the
+    # session runs
+    def __init__(self, path, chunk=4096, chunks=8):
+        self.path = path
+        self.chunk = chunk
+        self.ring = np.zeros(chunk * chunks, TELEMETRY_RECORD)
+        self.head = 0
+        self.queued = 0
+        self.written = 0
+        self.dropped = 0
+        self.chunks = queue.SimpleQueue()
+        self.file = open(path, "wb")
+        layout = json.dumps(TELEMETRY_RECORD.descr).encode()
+        self.file.write(TELEMETRY_HEADER.pack(TELEMETRY_MAGIC, TELEMETRY_VERSION, len(layout)) + layout)
+        self.writer = threading.Thread(target=self.write, name="telemetry", daemon=True)
+        self.writer.start()
+        PROFILER.recording = True
+        PROFILER.update_enabled()
+
+    def record(self):
+        if self.head - self.written == len(self.ring):
+            self.dropped += 1
+            return
+        times = PROFILER.times[(PROFILER.frames - 1) % PROFILER.history] * 1000
+        self.ring[self.head % len(self.ring)] = (runs_started, TIMELINE.time, BULLETS.live_count(),
+                                                 BEAMS.live_count(), player.get_x(), player.get_y(), player.health,
+                                                 PROFILER.frames, *times.tolist())
+        self.head += 1
+        if self.head - self.queued == self.chunk:
+            self.flush()
+
+    def flush(self):
+        # chunks divide the ring, so one never wraps around its end
+        if self.head > self.queued:
+            self.chunks.put((self.queued, self.head))
+            self.queued = self.head
+
+    def write(self):
+        while True:
+            span = self.chunks.get()
+            if span is None:
+                return
+            start, end = span
+            rows = self.ring[start % len(self.ring):(end - 1) % len(self.ring) + 1]
+            parts = [TELEMETRY_CHUNK.pack(len(rows))]
+            for name in TELEMETRY_RECORD.names:
+                data = zlib.compress(np.ascontiguousarray(rows[name]).tobytes(), 6)
+                parts.append(TELEMETRY_CHUNK.pack(len(data)))
+                parts.append(data)
+            self.file.write(b"".join(parts))
+            self.written = end
+
+    def close(self):
+        self.flush()
+        self.chunks.put(None)
+        self.writer.join()
+        self.file.close()
+        PROFILER.recording = False
+        PROFILER.update_enabled()
+        print("wrote %d telemetry records to %s%s" % (self.written, self.path,
+                                                     ", dropped %d" % self.dropped if self.dropped else ""))
+
+
+def load_telemetry(path):
+    # every complete chunk of a telemetry file as one record array; a chunk cut short by a crash is skipped
+    with open(path, "rb") as file:
+        data = file.read()
+    magic, version, length = TELEMETRY_HEADER.unpack_from(data, 0)
+    if magic != TELEMETRY_MAGIC or version != TELEMETRY_VERSION:
+        raise ValueError("%s is not a version %d telemetry file" % (path, TELEMETRY_VERSION))
+    pos = TELEMETRY_HEADER.size
+    record = np.dtype([tuple(field) for field in json.loads(data[pos:pos + length])])
+    pos += length
+    chunks = []
+    try:
+        while pos < len(data):
+            rows, = TELEMETRY_CHUNK.unpack_from(data, pos)
+            pos += TELEMETRY_CHUNK.size
+            chunk = np.zeros(rows, record)
+            for name in record.names:
+                size, = TELEMETRY_CHUNK.unpack_from(data, pos)
+                pos += TELEMETRY_CHUNK.size
+                chunk[name] = np.frombuffer(zlib.decompress(data[pos:pos + size]), record[name])
+                pos += size
+            chunks.append(chunk)
+    except (struct.error, zlib.error, ValueError):
+        pass
+    return np.concatenate(chunks) if chunks else np.zeros(0, record)
+
+
+class Store:
+    # object pool: every object is one slot in the FIELDS arrays. kill() only tombstones a slot,
+    # compact() runs once per frame to hand dead slots to the free list, and spawn() reuses them
+    FIELDS = {}
+    # the fields drawing reads, which is all pack() copies
+    DRAWN = ()
+
+    def __init__(self, capacity=1024):
+        # how far into the current frame new spawns were scheduled; they only advance for the rest of it
+        self.spawn_lag = 0
+        self.count = 0
+        self.capacity = capacity
+        self.free = []
+        self.high_water = 0
+        self.spawned = 0
+        self.reused = 0
+        for name, (dtype, default) in self.FIELDS.items():
+            setattr(self, name, np.zeros(capacity, dtype))
+
+    def spawn(self, kind):
+        self.spawned += 1
+        if self.free:
+            slot = self.free.pop()
+            self.reused += 1
+        else:
+            if self.count == self.capacity:
+                self.grow()
+            slot = self.count
+            self.count += 1
+            self.high_water = max(self.high_water, self.count)
+        for name, (dtype, default) in self.FIELDS.items():
+            getattr(self, name)[slot] = default
+        self.kind[slot] = kind
+        self.lag[slot] = self.spawn_lag
+        return slot
+
+    def spawn_rows(self, rows, start, end, lag):
+        # spawn() for a run of table rows at once; free slots are taken in the same order spawn() would
+        count = end - start
+        reused = min(len(self.free), count)
+        slots = np.empty(count, np.intp)
+        if reused:
+            slots[:reused] = self.free[:-reused - 1:-1]
+            del self.free[-reused:]
+        fresh = count - reused
+        while self.count + fresh > self.capacity:
+            self.grow()
+        slots[reused:] = np.arange(self.count, self.count + fresh)
+        self.count += fresh
+        self.high_water = max(self.high_water, self.count)
+        self.spawned += count
+        self.reused += reused
+        for name in self.FIELDS:
+            getattr(self, name)[slots] = rows[name][start:end]
+        self.lag[slots] = lag
+        return slots
+
+    def capture(self):
+        return {"count": self.count, "free": list(self.free),
+                "arrays": {name: getattr(self, name)[:self.count].copy() for name in self.FIELDS}}
+
+    def restore(self, snapshot):
+        self.clear()
+        while self.capacity < snapshot["count"]:
+            self.grow()
+        for name, array in snapshot["arrays"].items():
+            getattr(self, name)[:len(array)] = array
+        self.count = snapshot["count"]
+        self.free = list(snapshot["free"])
+
+    def pack(self, source):
+        # become a dense copy of source's live slots, to draw from while source moves on
+        live = source.live()
+        while self.capacity < len(live):
+            self.grow()
+        for name in self.DRAWN:
+            np.take(getattr(source, name), live, out=getattr(self, name)[:len(live)])
+        self.alive[:len(live)] = True
+        self.count = len(live)
+
+    def grow(self):
+        self.capacity *= 2
+        for name, (dtype, default) in self.FIELDS.items():
+            old = getattr(self, name)
+            new = np.zeros(self.capacity, dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def kill(self, slot):
+        self.alive[slot] = False
+
+    def clear(self):
+        self.alive[:self.count] = False
+        self.count = 0
+        self.free = []
+
+    def frame_dt(self, dt):
+        dt = dt - self.lag[:self.count]
+        self.lag[:self.count] = 0
+        return dt
+
+    def live(self, kind=0):
+        mask = self.alive[:self.count]
+        if kind:
+            mask = mask & (self.kind[:self.count] & kind != 0)
+        return np.flatnonzero(mask)
+
+    def live_count(self):
+        return int(np.count_nonzero(self.alive[:self.count]))
+
+    def compact(self):
+        live = self.live()
+        self.count = live[-1] + 1 if len(live) > 0 else 0
+        # popped from the end, so the lowest free slots are reused first and the live range stays dense
+        self.free = np.flatnonzero(~self.alive[:self.count])[::-1].tolist()
+
+    def stats(self):
+        reuse_rate = self.reused / self.spawned if self.spawned else 0
+        return "high water %d slots, reuse rate %.1f%%" % (self.high_water, reuse_rate * 100)
+
+
+def store_field(name, rebase=False):
+    def get(self):
+        return getattr(self.store, name)[self.slot]
+
+    def set(self, value):
+        getattr(self.store, name)[self.slot] = value
+        if rebase:
+            self.store.rebase(self.slot)
+    return property(get, set)
+
+
+class ExpiryWheel:
+    # slots filed under the time bucket they expire in, so a tick only opens the buckets it has reached.
+    # Rescheduling or killing a slot leaves its old entry behind; entries are checked against the store's
+    # exit times when their bucket comes up and dropped if they no longer match
+    def __init__(self, width=16):
+        self.width = width
+        self.current = 0
+        self.buckets = {}
+        self.due = []
+
+    def schedule(self, slots, times):
+        timed = times < np.inf
+        slots = slots[timed]
+        times = times[timed]
+        if len(slots) == 0:
+            return
+        # anything already past goes in the current bucket and comes up on the next expire()
+        keys = np.maximum(np.floor(times / self.width), self.current).astype(np.int64)
+        order = np.argsort(keys, kind="stable")
+        keys, slots, times = keys[order], slots[order], times[order]
+        unique, starts = np.unique(keys, return_index=True)
+        for key, start, end in zip(unique.tolist(), starts.tolist(), starts[1:].tolist() + [len(keys)]):
+            if key not in self.buckets:
+                self.buckets[key] = []
+                heapq.heappush(self.due, key)
+            self.buckets[key].append((slots[start:end], times[start:end]))
+
+    def expire(self, time, exit_time, alive):
+        # slots whose exit time is before time
+        self.current = math.floor(time / self.width)
+        if not self.due or self.due[0] > self.current:
+            return np.zeros(0, np.intp)
+        expired = []
+        waiting = []
+        while self.due and self.due[0] <= self.current:
+            entries = self.buckets.pop(heapq.heappop(self.due))
+            slots = np.concatenate([slots for slots, times in entries])
+            times = np.concatenate([times for slots, times in entries])
+            valid = alive[slots] & (exit_time[slots] == times)
+            slots, times = slots[valid], times[valid]
+            done = times < time
+            expired.append(slots[done])
+            waiting.append((slots[~done], times[~done]))
+        for slots, times in waiting:
+            self.schedule(slots, times)
+        return np.concatenate(expired) if expired else np.zeros(0, np.intp)
+
+    def reset(self, time=0):
+        self.current = math.floor(time / self.width)
+        self.buckets = {}
+        self.due = []
+
+
+class BulletStore(Store):
+    FIELDS = {
+        "x": (np.float64, 0),
+        "y": (np.float64, 0),
+        "prev_x": (np.float64, 0),
+        "prev_y": (np.float64, 0),
+        "x_speed": (np.float64, 0),
+        "y_speed": (np.float64, 0),
+        "speed": (np.float64, TMR_SPEED / 1000),
+        "radius": (np.float64, 6),
+        "kind": (np.uint8, 0),
+        "alive": (np.bool_, True),
+        "lag": (np.float64, 0),
+        "survive_off_screen": (np.bool_, False),
+        "theta": (np.float64, 0),
+        "orbit_radius": (np.float64, 0),
+        "radius_increment": (np.float64, 0),
+        "rotating": (np.bool_, True),
+        "start_x": (np.float64, 0),
+        "amplitude": (np.float64, 0),
+        "frequency": (np.float64, 0),
+        "bounces_left": (np.int32, -1),
+        "homing_speed": (np.float64, -1),
+        "homing_time": (np.float64, 0),
+        "homing_lifespan": (np.float64, -1),
+        # where and when the closed-form trajectory of an analytic bullet starts
+        "origin_x": (np.float64, 0),
+        "origin_y": (np.float64, 0),
+        "origin_theta": (np.float64, 0),
+        "origin_radius": (np.float64, MIN_ORBIT),
+        "origin_time": (np.float64, 0),
+        # store time an analytic bullet first goes off screen for good, filed in the expiry wheel once the
+        # rest of the tick's changes are in
+        "exit_time": (np.float64, np.inf),
+        "unscheduled": (np.bool_, False),
+    }
+    DRAWN = ("x", "y", "prev_x", "prev_y", "radius", "kind")
+
+    def __init__(self, capacity=1024):
+        super().__init__(capacity)
+        self.grid = SpatialGrid()
+        self.wheel = ExpiryWheel()
+        self.time = 0
+        # running total of bullets given the exact swept test; never reset, so per-frame counts are differences
+        self.narrow_tests = 0
+
+    def clear(self):
+        super().clear()
+        self.grid = SpatialGrid()
+        self.wheel.reset()
+        self.time = 0
+
+    def capture(self):
+        snapshot = super().capture()
+        snapshot["time"] = self.time
+        return snapshot
+
+    def restore(self, snapshot):
+        super().restore(snapshot)
+        self.time = snapshot["time"]
+        self.wheel.reset(self.time)
+        self.unscheduled[self.live()] = True
+
+    def spawn_rows(self, rows, start, end, lag):
+        slots = super().spawn_rows(rows, start, end, lag)
+        self.rebase(slots)
+        return slots
+
+    def rebase(self, idx):
+        # restart the trajectory from the current position; anything that moves a bullet or changes its
+        # motion parameters after spawning has to call this, or the change would apply retroactively
+        self.origin_x[idx] = self.x[idx]
+        self.origin_y[idx] = self.y[idx]
+        self.origin_theta[idx] = self.theta[idx]
+        self.origin_radius[idx] = np.maximum(self.orbit_radius[idx], MIN_ORBIT)
+        self.origin_time[idx] = self.time + self.lag[idx]
+        self.unscheduled[idx] = True
+
+    def collide(self, x, y, radius, prev_x, prev_y):
+        # the bullets each of a batch of circles touched over the last step, as one array per circle
+        circle, nearby = self.grid.query(x, y, radius + np.hypot(x - prev_x, y - prev_y))
+        alive = self.alive[nearby]
+        circle = circle[alive]
+        nearby = nearby[alive]
+        hit = self.swept_hits(nearby, x[circle], y[circle], radius[circle], prev_x[circle], prev_y[circle])
+        return group(circle[hit], nearby[hit], len(x))
+
+    def collide_one(self, x, y, radius, prev_x, prev_y):
+        # collide() for a single circle given as scalars, which is the whole of a one-player game
+        nearby = self.grid.query_one(x, y, radius + math.hypot(x - prev_x, y - prev_y))
+        nearby = nearby[self.alive[nearby]]
+        return nearby[self.swept_hits(nearby, x, y, radius, prev_x, prev_y)]
+
+    def swept_hits(self, nearby, x, y, radius, prev_x, prev_y):
+        # narrow phase for candidate bullets against the circle each was paired with (or one circle, as
+        # scalars): closest approach of the bullet relative to the circle over the last step
+        self.narrow_tests += len(nearby)
+        start_x = self.prev_x[nearby] - prev_x
+        start_y = self.prev_y[nearby] - prev_y
+        move_x = self.x[nearby] - x - start_x
+        move_y = self.y[nearby] - y - start_y
+        length = move_x * move_x + move_y * move_y
+        t = np.clip(-(start_x * move_x + start_y * move_y) / np.where(length > 0, length, 1), 0, 1)
+        dist = np.hypot(start_x + t * move_x, start_y + t * move_y)
+        return dist <= radius + self.radius[nearby]
+
+    def set_target(self, idx, x, y):
+        self.x_speed[idx], self.y_speed[idx] = unit_vector(x - self.x[idx], y - self.y[idx])
+        self.rebase(idx)
+
+    def targets(self, idx, target_x, target_y, width, height):
+        # homing bullets go after whichever player is closest
+        if len(target_x) == 1:
+            return target_x[0], target_y[0]
+        best = nearest(self.x[idx], self.y[idx], target_x, target_y, width, height)
+        return target_x[best], target_y[best]
+
+    def update(self, dt, target_x, target_y, width, height):
+        self.time += dt
+        dt = self.frame_dt(dt)
+        n = self.count
+        self.prev_x[:n] = self.x[:n]
+        self.prev_y[:n] = self.y[:n]
+        homing = self.live(HOMING)
+        self.steer(homing, dt[homing], *self.targets(homing, target_x, target_y, width, height))
+
+        # homing and bouncing bullets are stepped; the rest are evaluated at the new time in one pass
+        kind = self.kind[:n]
+        integrated = kind & INTEGRATED != 0
+        speed = self.speed[:n]
+        x_speed = self.x_speed[:n]
+        y_speed = self.y_speed[:n]
+        tau = self.time - self.origin_time[:n]
+        x = self.x[:n]
+        y = self.y[:n]
+        x[:] = np.where(integrated, x + x_speed * speed * dt, self.origin_x[:n] + x_speed * speed * tau)
+        y[:] = np.where(integrated, y + y_speed * speed * dt, self.origin_y[:n] + y_speed * speed * tau)
+        analytic = self.alive[:n] & ~integrated
+        spiral = np.flatnonzero(analytic & self.rotating[:n] & (kind & CIRCULAR != 0))
+        if len(spiral):
+            x[spiral], y[spiral], theta, radius = self.spiral(spiral, tau[spiral])
+            self.theta[spiral] = theta
+            self.orbit_radius[spiral] = radius
+            self.x_speed[spiral] = -np.sin(theta)
+            self.y_speed[spiral] = np.cos(theta)
+        wave = np.flatnonzero(analytic & (kind & SINUSOIDAL != 0))
+        if len(wave):
+            y[wave], self.y_speed[wave] = self.wave(wave, x[wave], tau[wave])
+
+        # analytic bullets die at their exit time; stepped and spiralling ones are checked against the screen
+        unscheduled = np.flatnonzero(self.unscheduled[:n] & self.alive[:n])
+        if len(unscheduled):
+            self.unscheduled[:n] = False
+            self.exit_time[unscheduled] = self.exit_times(unscheduled, width, height)
+            self.wheel.schedule(unscheduled, self.exit_time[unscheduled])
+        self.alive[self.wheel.expire(self.time, self.exit_time, self.alive)] = False
+        checked = np.flatnonzero(self.alive[:n] & ~self.survive_off_screen[:n] &
+                                 (integrated | (self.rotating[:n] & (kind & CIRCULAR != 0))))
+        radius = self.radius[checked]
+        cx = x[checked]
+        cy = y[checked]
+        off_screen = (cx + radius < 0) | (cx - radius > width) | (cy + radius < 0) | (cy - radius > height)
+        lifespan = self.homing_lifespan[checked]
+        off_screen &= ~((kind[checked] & HOMING != 0) & (lifespan > 0) & (self.homing_time[checked] < lifespan))
+        self.alive[checked[off_screen]] = False
+
+        radius = self.radius[:n]
+        bouncing = self.alive[:n] & (kind & BOUNCING != 0)
+        self.bounce(np.flatnonzero(bouncing & (self.bounces_left[:n] != 0) & ((x - radius < 0) | (x + radius > width))),
+                    True, target_x, target_y, width, height)
+        self.bounce(np.flatnonzero(bouncing & (self.bounces_left[:n] != 0) & ((y - radius < 0) | (y + radius > height))),
+                    False, target_x, target_y, width, height)
+        self.compact()
+        n = self.count
+        self.grid.rebuild(self.x[:n], self.y[:n], self.prev_x[:n], self.prev_y[:n], self.radius[:n], self.alive[:n],
+                          width, height)
+
+    def exit_times(self, idx, width, height):
+        # straight-line bullets are off screen from the first moment either coordinate leaves its range and
+        # never come back; sine waves only die past the right edge. The rest never expire on a timer
+        kind = self.kind[idx]
+        radius = self.radius[idx]
+        x_velocity = self.x_speed[idx] * self.speed[idx]
+        y_velocity = self.y_speed[idx] * self.speed[idx]
+        tau = np.minimum(leave_time(self.origin_x[idx], x_velocity, -radius, width + radius),
+                         leave_time(self.origin_y[idx], y_velocity, -radius, height + radius))
+        tau[self.survive_off_screen[idx]] = np.inf
+        wave = kind & SINUSOIDAL != 0
+        tau[wave] = leave_time(self.origin_x[idx[wave]], x_velocity[wave], -np.inf, width)
+        tau[(kind & INTEGRATED != 0) | (self.rotating[idx] & (kind & CIRCULAR != 0))] = np.inf
+        return self.origin_time[idx] + tau
+
+    def steer(self, idx, dt, target_x, target_y):
+        if len(idx) == 0:
+            return
+        lifespan = self.homing_lifespan[idx]
+        timed = lifespan > 0
+        homing_time = self.homing_time[idx] + np.where(timed, dt, 0)
+        self.homing_time[idx] = homing_time
+        homing_speed = np.where(timed & (homing_time > lifespan), 0, self.homing_speed[idx])
+        self.homing_speed[idx] = homing_speed
+
+        # blend the heading with a step of homing_speed * dt towards the target, as seen from one step ahead;
+        # a negative homing speed turns straight at the target
+        x_speed = self.x_speed[idx]
+        y_speed = self.y_speed[idx]
+        ahead_x = self.x[idx] + x_speed
+        ahead_y = self.y[idx] + y_speed
+        pull_x, pull_y = unit_vector(target_x - ahead_x, target_y - ahead_y)
+        pull = homing_speed * dt
+        direct = homing_speed < 0
+        heading_x, heading_y = unit_vector(np.where(direct, target_x - self.x[idx], x_speed + pull_x * pull),
+                                           np.where(direct, target_y - self.y[idx], y_speed + pull_y * pull))
+        steering = homing_speed != 0
+        self.x_speed[idx] = np.where(steering, heading_x, x_speed)
+        self.y_speed[idx] = np.where(steering, heading_y, y_speed)
+
+    def spiral(self, idx, tau):
+        # moving at speed s tangentially while the orbit grows linearly by k gives theta' = s / r, a log spiral
+        # r = r0 e^(a (theta - theta0)) with a = k / s. Integrating r (-sin, cos) dtheta along it gives
+        # G(theta) - G(theta0) with G = r / (1 + a^2) (cos - a sin, sin + a cos); a = 0 is a plain circle
+        r0 = self.origin_radius[idx]
+        theta0 = self.origin_theta[idx]
+        speed = self.speed[idx]
+        growth = self.radius_increment[idx]
+        radius = np.maximum(r0 + growth * tau, MIN_ORBIT)
+        growing = growth != 0
+        safe_growth = np.where(growing, growth, 1)
+        theta = theta0 + np.where(growing, speed / safe_growth * np.log(radius / r0), speed / r0 * tau)
+        a = np.where(speed != 0, growth / np.where(speed != 0, speed, 1), 0)
+        scale = np.where(speed != 0, 1 / (1 + a * a), 0)
+        cos = np.cos(theta)
+        sin = np.sin(theta)
+        cos0 = np.cos(theta0)
+        sin0 = np.sin(theta0)
+        x = self.origin_x[idx] + scale * (radius * (cos - a * sin) - r0 * (cos0 - a * sin0))
+        y = self.origin_y[idx] + scale * (radius * (sin + a * cos) - r0 * (sin0 + a * cos0))
+        # a shrinking orbit bottoms out at MIN_ORBIT and from then on just spins in place
+        clamped = np.maximum(tau - (MIN_ORBIT - r0) / np.where(growth < 0, growth, -1), 0)
+        theta = theta + np.where(growth < 0, speed / MIN_ORBIT * clamped, 0)
+        return x, y, theta, radius
+
+    def wave(self, idx, x, tau):
+        # y' = A F cos(F (x - start_x)) per unit of x travelled, so y = A / x_speed sin(F (x - start_x)) + C
+        frequency = self.frequency[idx]
+        amplitude = self.amplitude[idx]
+        x_speed = self.x_speed[idx]
+        phase0 = frequency * (self.origin_x[idx] - self.start_x[idx])
+        phase = frequency * (x - self.start_x[idx])
+        moving = x_speed != 0
+        rise = np.where(moving, amplitude / np.where(moving, x_speed, 1) * (np.sin(phase) - np.sin(phase0)),
+                        amplitude * frequency * self.speed[idx] * np.cos(phase0) * tau)
+        return self.origin_y[idx] + rise, amplitude * frequency * np.cos(phase)
+
+    def bounce(self, idx, horizontal, target_x, target_y, width, height):
+        if len(idx) == 0:
+            return
+        self.bounces_left[idx] -= 1
+        homing = self.kind[idx] & HOMING != 0
+        if horizontal:
+            self.x_speed[idx[~homing]] *= -1
+        else:
+            self.y_speed[idx[~homing]] *= -1
+        self.set_target(idx[homing], *self.targets(idx[homing], target_x, target_y, width, height))
+
+    def sprite_positions(self, alpha=1):
+        live = self.live()
+        prev_x = self.prev_x[live]
+        prev_y = self.prev_y[live]
+        radius = np.round(self.radius[live]).astype(np.intp)
+        # top-left corner of each sprite
+        x = np.round(prev_x + (self.x[live] - prev_x) * alpha).astype(np.intp) - radius
+        y = np.round(prev_y + (self.y[live] - prev_y) * alpha).astype(np.intp) - radius
+        return x, y, radius
+
+    def bounds(self, alpha=1):
+        x, y, radius = self.sprite_positions(alpha)
+        return x, y, x + 2 * radius + 1, y + 2 * radius + 1
+
+    def draw(self, surface, color, alpha=1, sprites=None):
+        # looked up per call, so a SpriteCache swapped in for SPRITES is the one that gets used and evicted
+        if sprites is None:
+            sprites = SPRITES
+        x, y, radius = self.sprite_positions(alpha)
+        width, height = surface.get_size()
+        visible = (x < width) & (y < height) & (x + 2 * radius >= 0) & (y + 2 * radius >= 0)
+        x, y, radius = x[visible], y[visible], radius[visible]
+        for r in np.unique(radius).tolist():
+            same = radius == r
+            positions = zip(x[same].tolist(), y[same].tolist())
+            surface.blits(zip(itertools.repeat(sprites.get(r, color)), positions), doreturn=False)
+
+
+BULLETS = BulletStore()
+
+
+class Bullet:
+    kind = 0
+
+    x_speed = store_field("x_speed", rebase=True)
+    y_speed = store_field("y_speed", rebase=True)
+    speed = store_field("speed", rebase=True)
+    survive_off_screen = store_field("survive_off_screen", rebase=True)
 
-    def update(self, dt):
-        self.move(self.x_speed * self.speed * dt, self.y_speed * self.speed * dt)
-        if self.can_kill():
-            self.kill()
+    def __init__(self):
+        self.store = BULLETS
+        self.slot = BULLETS.spawn(self.kind)
+
+    def get_x(self):
+        return self.store.x[self.slot]
+
+    def get_y(self):
+        return self.store.y[self.slot]
+
+    def get_radius(self):
+        return self.store.radius[self.slot]
+
+    def set_position(self, x, y):
+        self.store.x[self.slot] = x
+        self.store.y[self.slot] = y
+        self.store.rebase(self.slot)
 
-    def can_kill(self):
-        return not self.survive_off_screen and (self.get_x() + self.get_radius() < 0 or
-               self.get_x() - self.get_radius() > screen.get_width() or
-               self.get_y() + self.get_radius() < 0 or self.get_y() - self.get_radius() > screen.get_height())
+    def move(self, dx, dy):
+        self.set_position(self.get_x() + dx, self.get_y() + dy)
 
-    def draw(self):
-        global bullet_color
-        pygame.draw.circle(screen, bullet_color, (self.get_x(), self.get_y()), self.get_radius())
+    def kill(self):
+        self.store.kill(self.slot)
 
     def on_col(self):
         self.kill()
@@ -191,353 +1586,1013 @@ class Bullet(GameObject):
 
 
 class HomingBullet(Bullet):
-    def __init__(self):
-        super().__init__()
-        self.homing_speed = -1
-        self.homing_time = 0
-        self.homing_lifespan = -1
+    kind = HOMING
 
-    def update(self, dt):
-        global player
-        if self.homing_lifespan > 0:
-            self.homing_time += dt
-            if self.homing_time > self.homing_lifespan:
-                self.homing_speed = 0
-
-        if self.homing_speed < 0:
-            self.set_target(player.get_x(), player.get_y())
-        elif self.homing_speed > 0:
-            next_x = self.get_x() + self.x_speed
-            next_y = self.get_y() + self.y_speed
-            theta = math.atan2(player.get_y() - next_y, player.get_x() - next_x)
-            self.set_target(next_x + math.cos(theta) * self.homing_speed * dt,
-                            next_y + math.sin(theta) * self.homing_speed * dt)
-        super().update(dt)
-
-    def can_kill(self):
-        if self.homing_lifespan > 0 and self.homing_time < self.homing_lifespan:
-            return False
-        return super().can_kill()
+    homing_speed = store_field("homing_speed")
+    homing_time = store_field("homing_time")
+    homing_lifespan = store_field("homing_lifespan")
 
 
 class BouncingBullet(Bullet):
-    def __init__(self):
-        super().__init__()
-        self.bounces_left = -1
+    kind = BOUNCING
 
-    def update(self, dt):
-        super().update(dt)
-        if self.bounces_left != 0 and (
-                self.get_x() - self.get_radius() < 0 or self.get_x() + self.get_radius() > screen.get_width()):
-            self.bounces_left -= 1
-            self.on_bounce(True)
-        if self.bounces_left != 0 and (
-                self.get_y() - self.get_radius() < 0 or self.get_y() + self.get_radius() > screen.get_height()):
-            self.bounces_left -= 1
-            self.on_bounce(False)
-
-    def on_bounce(self, horizontal):
-        if horizontal:
-            self.x_speed *= -1
-        else:
-            self.y_speed *= -1
+    bounces_left = store_field("bounces_left")
 
 
 class HomingBouncingBullet(BouncingBullet, HomingBullet):
-    def on_bounce(self, horizontal):
-        self.set_target(player.get_x(), player.get_y())
+    # re-targets the player on every bounce instead of reflecting
+    kind = HOMING | BOUNCING
 
 
 class CircularBullet(Bullet):
-    def __init__(self):
-        super().__init__()
-        self.theta = 0
-        self.radius = 0
-        self.radius_increment = 0
-        self.rotating = True
+    kind = CIRCULAR
 
-    def update(self, dt):
-        if self.rotating:
-            self.radius += self.radius_increment * dt
-            if self.radius <= 0:
-                self.radius = 0.01
-            self.theta += self.speed / self.radius * dt
-
-            self.x_speed = -math.sin(self.theta)
-            self.y_speed = math.cos(self.theta)
-
-        super().update(dt)
+    theta = store_field("theta", rebase=True)
+    radius = store_field("orbit_radius", rebase=True)
+    radius_increment = store_field("radius_increment", rebase=True)
+    rotating = store_field("rotating", rebase=True)
 
 
 class SinusoidalBullet(Bullet):
-    def __init__(self):
-        super().__init__()
-        self.start_x = 0
-        self.amplitude = 0
-        self.frequency = 0
-
-    def set_position(self, x, y):
-        super().set_position(x, y)
+    kind = SINUSOIDAL
+
+    start_x = store_field("start_x", rebase=True)
+    amplitude = store_field("amplitude", rebase=True)
+    frequency = store_field("frequency", rebase=True)
+
+
+BEAM_MOVING = 1
+BEAM_CIRCULAR = 2
+BEAM_REVERSE = 4
+
+
+class BeamStore(Store):
+    FIELDS = {
+        "x1": (np.float64, 0),
+        "y1": (np.float64, 0),
+        "x2": (np.float64, 0),
+        "y2": (np.float64, 0),
+        "cx": (np.float64, 0),
+        "cy": (np.float64, 0),
+        "radius": (np.float64, 0),
+        "kind": (np.uint8, 0),
+        "alive": (np.bool_, True),
+        "lag": (np.float64, 0),
+        "delay": (np.float64, 0),
+        "lifespan": (np.float64, 0),
+        "time_since": (np.float64, 0),
+        "bursts": (np.int32, 1),
+        "started_wait": (np.bool_, False),
+        "started_hold": (np.bool_, False),
+        "dim": (np.bool_, True),
+        "width": (np.int32, 2),
+        "damage_within": (np.bool_, True),
+        "radius_increment": (np.float64, 0),
+        "speed": (np.float64, 0),
+        "x_speed": (np.float64, 0),
+        "y_speed": (np.float64, 0),
+        "shift_x": (np.float64, 0),
+        "shift_y": (np.float64, 0),
+    }
+    DRAWN = ("x1", "y1", "x2", "y2", "cx", "cy", "radius", "kind", "dim", "width", "damage_within",
+             "radius_increment", "speed", "x_speed", "y_speed")
 
     def update(self, dt):
-        # derivative of Asin(Fx) + C
-        self.y_speed = self.amplitude * self.frequency * math.cos(self.frequency * (self.circ.x - self.start_x))
-        super().update(dt)
-
-    def can_kill(self):
-        return self.circ.x > screen.get_width()
-
+        dt = self.frame_dt(dt)
+        n = self.count
+        time_since = self.time_since[:n]
+        waiting = self.started_wait[:n]
+        holding = self.started_hold[:n]
+        dim = self.dim[:n]
+        time_since += dt
+
+        ready = waiting & (time_since >= self.delay[:n])
+        holding |= ready
+        waiting &= ~ready
+        dim &= ~ready
+
+        done = holding & (time_since >= self.delay[:n] + self.lifespan[:n])
+        holding &= ~done
+        dim |= done
+        bursts = self.bursts[:n]
+        bursts -= done
+        spent = done & (bursts <= 0)
+        self.alive[:n] &= ~spent
+        again = done & ~spent
+        waiting |= again
+        time_since[again] = 0
+
+        self.radius[:n] += self.radius_increment[:n] * dt
+        shift_x = self.shift_x[:n]
+        shift_y = self.shift_y[:n]
+        shift_x[:] = self.x_speed[:n] * self.speed[:n] * dt
+        shift_y[:] = self.y_speed[:n] * self.speed[:n] * dt
+        self.x1[:n] += shift_x
+        self.x2[:n] += shift_x
+        self.y1[:n] += shift_y
+        self.y2[:n] += shift_y
+        self.compact()
+
+    def collide(self, x, y, radius, prev_x, prev_y):
+        # the beams each of a batch of circles touched over the last step, as one array per circle. Beams are
+        # few and mostly span the screen, so every circle is tested against every active beam
+        active, hits = self.hit_test(*(np.asarray(v)[:, None] for v in (x, y, radius, prev_x, prev_y)))
+        return [active[row] for row in hits]
+
+    def collide_one(self, x, y, radius, prev_x, prev_y):
+        # collide() for a single circle given as scalars
+        active, hits = self.hit_test(x, y, radius, prev_x, prev_y)
+        return active[hits]
+
+    def hit_test(self, x, y, radius, prev_x, prev_y):
+        # the active beams, and whether the circle touched each; circles given as a column get a row each
+        n = self.count
+        active = np.flatnonzero(self.alive[:n] & self.started_hold[:n])
+        if len(active) == 0:
+            return active, np.zeros(np.broadcast(x, active).shape, bool)
+        kind = self.kind[active]
+        circular = kind & BEAM_CIRCULAR != 0
+        lines = active[~circular]
+        rings = active[circular]
+
+        # lines are finite segments swept against the circle's path; seen from the beam, which moved by
+        # its shift over the last step, the circle travelled from prev + shift to its current position
+        line_hit = segment_distance(prev_x + self.shift_x[lines], prev_y + self.shift_y[lines], x, y,
+                                    self.x1[lines], self.y1[lines], self.x2[lines], self.y2[lines]) <= radius
+
+        dist = np.hypot(self.cx[rings] - x, self.cy[rings] - y)
+        outer = self.radius[rings]
+        ring_hit = np.where(self.damage_within[rings], dist <= radius + outer,
+                            (outer - radius <= dist) & (dist <= radius + outer))
+        ring_hit = np.where(kind[circular] & BEAM_REVERSE != 0, dist > outer - radius, ring_hit)
+
+        return np.concatenate((lines, rings)), np.concatenate((line_hit, ring_hit), -1)
+
+    def mark_dirty(self, dirty, rewind=0):
+        for slot in self.live().tolist():
+            kind = self.kind[slot]
+            width = self.width[slot]
+            if kind & BEAM_REVERSE:
+                dirty.mark(0, 0, dirty.width, dirty.height)
+            elif kind & BEAM_CIRCULAR:
+                radius = self.radius[slot] - self.radius_increment[slot] * rewind + 1
+                dirty.mark(self.cx[slot] - radius, self.cy[slot] - radius, self.cx[slot] + radius,
+                           self.cy[slot] + radius)
+            else:
+                dx = self.x_speed[slot] * self.speed[slot] * rewind
+                dy = self.y_speed[slot] * self.speed[slot] * rewind
+                dirty.mark_line(self.x1[slot] - dx, self.y1[slot] - dy, self.x2[slot] - dx, self.y2[slot] - dy, width)
+
+    def draw(self, surface, overlay, color, rewind=0):
+        # beams move and grow at constant rates, so interpolating is just winding them back by rewind ms
+        for slot in self.live().tolist():
+            beam_color = DIM_GREY if self.dim[slot] else color
+            kind = self.kind[slot]
+            center = (self.cx[slot], self.cy[slot])
+            radius = self.radius[slot] - self.radius_increment[slot] * rewind
+            if kind & BEAM_REVERSE:
+                overlay.add(center, radius, beam_color, reverse=True)
+            elif not kind & BEAM_CIRCULAR:
+                dx = self.x_speed[slot] * self.speed[slot] * rewind
+                dy = self.y_speed[slot] * self.speed[slot] * rewind
+                pygame.draw.line(surface, beam_color, (self.x1[slot] - dx, self.y1[slot] - dy),
+                                 (self.x2[slot] - dx, self.y2[slot] - dy), self.width[slot])
+            elif self.damage_within[slot]:
+                overlay.add(center, radius, beam_color)
+            else:
+                pygame.draw.circle(surface, beam_color, center, radius, self.width[slot])
+
+
+BEAMS = BeamStore()
+
+
+class Beam:
+    kind = 0
+
+    delay = store_field("delay")
+    lifespan = store_field("lifespan")
+    bursts = store_field("bursts")
+    width = store_field("width")
+    started_wait = store_field("started_wait")
+    started_hold = store_field("started_hold")
 
-class Beam(GameObject):
     def __init__(self, line):
-        super().__init__(Circle(0, 0, 0))
-        self.delay = 0
-        self.lifespan = 0
-        self.line = line
-        self.color = DIM_GREY
-        self.started_wait = False
-        self.started_hold = False
-        self.width = 2
-        self.bursts = 1
-        self.time_since = 0
+        self.store = BEAMS
+        self.slot = BEAMS.spawn(self.kind)
+        self.store.x1[self.slot] = line.x1
+        self.store.y1[self.slot] = line.y1
+        self.store.x2[self.slot] = line.x2
+        self.store.y2[self.slot] = line.y2
 
     def start_delay(self, delay):
         self.delay = delay
         self.started_wait = True
 
-    def draw(self):
-        color = bullet_color
-        if self.color == DIM_GREY:
-            color = DIM_GREY
-        pygame.draw.line(screen, color, (self.line.x1, self.line.y1), (self.line.x2, self.line.y2), self.width)
-
-    def update(self, dt):
-        self.time_since += dt
-        if self.started_wait:
-            if self.time_since >= self.delay:
-                self.started_hold = True
-                self.started_wait = False
-                self.color = bullet_color
-        if self.started_hold:
-            if self.time_since >= self.delay + self.lifespan:
-                self.started_hold = False
-                self.bursts -= 1
-                self.color = DIM_GREY
-                if self.bursts <= 0:
-                    self.kill()
-                else:
-                    self.started_wait = True
-                    self.time_since = 0
-
-    def intersects(self, circ):
-        if not self.started_hold:
-            return False
-
-        line = self.line
-        if line.x2 - line.x1 == 0:
-            return circ.x - circ.radius < line.x1 < circ.x + circ.radius
-
-        a = circ.x
-        b = circ.y
-        c = line.y1
-        m = (line.y2 - line.y1) / (line.x2 - line.x1)
-        r = circ.radius
-
-        # discriminant of solution to the equation (x-a)^2 + (mx+b-c)^2 = r^2
-        return -a * a * m * m + 2 * a * b * m - 2 * a * c * m - b * b + 2 * b * c - c * c + r * r * m * m + r * r >= 0
+    def kill(self):
+        self.store.kill(self.slot)
 
 
 class CircularBeam(Beam):
+    kind = BEAM_CIRCULAR
+
+    damage_within = store_field("damage_within")
+    radius_increment = store_field("radius_increment")
+
     def __init__(self, circ):
         super().__init__(Line(0, 0, 0, 0))
-        self.circ = circ
-        self.damage_within = True
-        self.radius_increment = 0
-
-    def intersects(self, circ):
-        if not self.started_hold:
-            return False
-        dist = math.dist((circ.x, circ.y), (self.circ.x, self.circ.y))
-        if self.damage_within:
-            return dist <= circ.radius + self.circ.radius
-        else:
-            return self.circ.radius - circ.radius <= dist <= circ.radius + self.circ.radius
-
-    def draw(self):
-        color = bullet_color
-        if self.color == DIM_GREY:
-            color = DIM_GREY
-        if self.damage_within:
-            pygame.draw.circle(circular_beam_surface, color, (self.get_x(), self.get_y()), self.get_radius())
-        else:
-            pygame.draw.circle(screen, color, (self.get_x(), self.get_y()), self.get_radius(), self.width)
+        self.store.cx[self.slot] = circ.x
+        self.store.cy[self.slot] = circ.y
+        self.store.radius[self.slot] = circ.radius
 
-    def update(self, dt):
-        super().update(dt)
-        self.circ.radius += self.radius_increment * dt
+    def get_x(self):
+        return self.store.cx[self.slot]
 
+    def get_y(self):
+        return self.store.cy[self.slot]
 
-class MovingBeam(Beam):
+    def get_radius(self):
+        return self.store.radius[self.slot]
 
-    def __init__(self, line):
-        super().__init__(line)
-        self.speed = 0
-        self.x_speed = 0
-        self.y_speed = 0
 
-    def update(self, dt):
-        super().update(dt)
-        self.line.x1 += self.x_speed * self.speed * dt
-        self.line.x2 += self.x_speed * self.speed * dt
-        self.line.y1 += self.y_speed * self.speed * dt
-        self.line.y2 += self.y_speed * self.speed * dt
+class MovingBeam(Beam):
+    kind = BEAM_MOVING
 
+    speed = store_field("speed")
+    x_speed = store_field("x_speed")
+    y_speed = store_field("y_speed")
 
-class ReverseCircularBeam(CircularBeam):
-    def intersects(self, circ):
-        if not self.started_hold:
-            return False
-        dist = math.dist((circ.x, circ.y), (self.circ.x, self.circ.y))
-        return dist > self.circ.radius - circ.radius
 
-    def draw(self):
-        color = bullet_color
-        if self.color == DIM_GREY:
-            color = DIM_GREY
-        circular_beam_surface.fill(color)
-        pygame.draw.circle(circular_beam_surface, (0, 0, 0, 0), (self.get_x(), self.get_y()), self.get_radius())
+class ReverseCircularBeam(CircularBeam):
+    # damages everywhere outside its circle
+    kind = BEAM_CIRCULAR | BEAM_REVERSE
 
 
 class BulletEvent:
-    def __init__(self, delay, event, lifespan=0):
+    # one chart entry; all times are song times, and starting later than 0 restores a snapshot instead of
+    # shifting events
+    def __init__(self, delay, event, lifespan=0, params=None, counter=None, step=0):
         self.event = event
         self.delay = delay
         self.initial_delay = 0
-        self.time_since = 0
         if lifespan != 0:
-            self.lifespan = lifespan - START_TIME
+            self.lifespan = lifespan
         else:
-            self.lifespan = 0
-        self.first = True
+            self.lifespan = None
+        self.params = params or {}
+        # events naming a counter get its running value as n and advance it by step; the rest count their own
+        # occurrences
+        self.counter = counter
+        self.step = step
 
         self.set_initial_delay(delay)
 
-    def set_initial_delay(self, init_delay):
-        self.initial_delay = init_delay - START_TIME
-        if self.initial_delay < 0:
-            self.initial_delay = self.delay
+    @classmethod
+    def from_chart(cls, entry):
+        name = entry["pattern"]
+        if name not in COMPILED_PATTERNS and name not in RUNTIME_PATTERNS:
+            raise ValueError("unknown pattern %r in chart" % name)
+        event = cls(entry["period"], COMPILED_PATTERNS.get(name) or RUNTIME_PATTERNS[name], entry.get("end") or 0,
+                    entry.get("params"), entry.get("counter"), entry.get("step", 0))
+        event.set_initial_delay(entry.get("start", entry["period"]))
+        return event
 
-    def update(self, dt):
-        if self.first:
-            delay = self.initial_delay
+    def set_initial_delay(self, init_delay):
+        self.initial_delay = init_delay
+
+    def next_time(self, last_time):
+        # after the first firing, events land on whole multiples of their delay
+        if last_time is None:
+            next_time = self.initial_delay
+        elif self.delay == 0:
+            return None
         else:
-            delay = self.delay
-
-        last_time = self.time_since
-        self.time_since += dt
-
-        if self.time_since > self.lifespan and not self.lifespan == 0:
-            self.kill()
-        if delay == 0 or self.time_since % delay < last_time % delay:
-            if self.first:
-                self.first = False
-            self.event()
-
-    def kill(self):
-        BULLET_EVENTS.remove(self)
-
-
-def main():
-    global circle_2_offset, sine_pos, offset, slow_hell_offset, pentagram_offset, player, START_TIME
-
-    pentagram_offset = 0
-    slow_hell_offset = 0
-    offset = 0
-    sine_pos = 0
-    circle_2_offset = 0
-
-    player = Player(Circle(0, 0, 6))
-    player.set_position(screen.get_width() / 2, screen.get_height() / 2)
+            next_time = (last_time // self.delay + 1) * self.delay
+        if self.lifespan is not None and next_time > self.lifespan:
+            return None
+        return next_time
+
+    def occurrences(self, length):
+        # open-ended events run to the end of the chart
+        times = []
+        time = self.next_time(None)
+        while time is not None and time <= length:
+            times.append(time)
+            time = self.next_time(time)
+        return times
+
+
+class SpawnTable:
+    # store rows sorted by (time, event order); spawning whatever is due is one bulk copy per field
+    def __init__(self, fields, chunks):
+        self.columns = {name: np.concatenate([chunk[name] for chunk in chunks]) if chunks else np.zeros(0, dtype)
+                        for name, (dtype, default) in fields.items()}
+        self.time = np.concatenate([chunk["time"] for chunk in chunks]) if chunks else np.zeros(0)
+        self.order = np.concatenate([chunk["order"] for chunk in chunks]) if chunks else np.zeros(0, np.intp)
+
+    def __len__(self):
+        return len(self.time)
+
+    def due(self, time, order=None):
+        # end of the rows before (time, order), or of every row up to time inclusive when order is None
+        if order is None:
+            return int(np.searchsorted(self.time, time, "right"))
+        start = int(np.searchsorted(self.time, time, "left"))
+        end = int(np.searchsorted(self.time, time, "right"))
+        return start + int(np.searchsorted(self.order[start:end], order, "left"))
+
+
+class Chart:
+    def __init__(self, events, bullets, beams, calls):
+        self.events = events
+        self.bullets = bullets
+        self.beams = beams
+        self.call_time = np.array([time for time, order, n in calls], np.float64)
+        self.call_order = [order for time, order, n in calls]
+        self.call_n = [n for time, order, n in calls]
+
+
+def compile_chart(chart):
+    # walk every occurrence in firing order. Compiled patterns run once here against scratch stores and what
+    # they spawned is kept as rows; runtime patterns become calls, with the n they will be passed
+    global BULLETS, BEAMS
+    events = [BulletEvent.from_chart(entry) for entry in chart["events"]]
+    occurrences = sorted((time, order) for order, event in enumerate(events)
+                         for time in event.occurrences(chart["length"]))
+    counters = {}
+    fired = [0] * len(events)
+    bullet_chunks = []
+    beam_chunks = []
+    calls = []
+    stores = BULLETS, BEAMS
+    BULLETS, BEAMS = BulletStore(), BeamStore()
+    try:
+        for time, order in occurrences:
+            event = events[order]
+            if event.counter is None:
+                n = fired[order]
+            else:
+                n = counters.get(event.counter, 0)
+                counters[event.counter] = n + event.step
+            fired[order] += 1
+            if event.event in COMPILED_PATTERNS.values():
+                BULLETS.clear()
+                BEAMS.clear()
+                event.event(n, **event.params)
+                for store, chunks in ((BULLETS, bullet_chunks), (BEAMS, beam_chunks)):
+                    if store.count:
+                        chunk = {name: getattr(store, name)[:store.count].copy() for name in store.FIELDS}
+                        chunk["time"] = np.full(store.count, time, np.float64)
+                        chunk["order"] = np.full(store.count, order, np.intp)
+                        chunks.append(chunk)
+            else:
+                calls.append((time, order, n))
+    finally:
+        BULLETS, BEAMS = stores
+    return Chart(events, SpawnTable(BulletStore.FIELDS, bullet_chunks), SpawnTable(BeamStore.FIELDS, beam_chunks),
+                 calls)
+
+
+def load_chart(path):
+    if path not in CHARTS:
+        with open(path) as file:
+            CHARTS[path] = compile_chart(json.load(file))
+    return CHARTS[path]
+
+
+class Timeline:
+    # plays a compiled chart: due spawn rows are copied into the stores in bulk, and runtime calls run in
+    # between them, so events on the same time still happen in chart order
+    def __init__(self):
+        self.time = 0
+        self.chart = None
+        self.next_bullet = 0
+        self.next_beam = 0
+        self.next_call = 0
+
+    def load(self, chart):
+        self.clear()
+        self.chart = chart
+
+    def clear(self):
+        self.time = 0
+        self.chart = None
+        self.next_bullet = 0
+        self.next_beam = 0
+        self.next_call = 0
+
+    def capture(self):
+        return {"time": self.time, "next": (self.next_bullet, self.next_beam, self.next_call)}
+
+    def restore(self, snapshot):
+        self.time = snapshot["time"]
+        self.next_bullet, self.next_beam, self.next_call = snapshot["next"]
+
+    def advance(self, dt):
+        frame_start = self.time
+        self.time += dt
+        chart = self.chart
+        if chart is None:
+            return
+        end = int(np.searchsorted(chart.call_time, self.time, "right"))
+        # every occurrence that fell inside this frame runs, in order, even if several are due at once
+        while self.next_call < end:
+            call = self.next_call
+            fire_time = chart.call_time[call]
+            order = chart.call_order[call]
+            self.spawn(fire_time, order, frame_start)
+            BULLETS.spawn_lag = BEAMS.spawn_lag = fire_time - frame_start
+            event = chart.events[order]
+            event.event(chart.call_n[call], **event.params)
+            self.next_call += 1
+        BULLETS.spawn_lag = BEAMS.spawn_lag = 0
+        self.spawn(self.time, None, frame_start)
+
+    def spawn(self, time, order, frame_start):
+        end = self.chart.bullets.due(time, order)
+        if end > self.next_bullet:
+            table = self.chart.bullets
+            BULLETS.spawn_rows(table.columns, self.next_bullet, end, table.time[self.next_bullet:end] - frame_start)
+            self.next_bullet = end
+        end = self.chart.beams.due(time, order)
+        if end > self.next_beam:
+            table = self.chart.beams
+            BEAMS.spawn_rows(table.columns, self.next_beam, end, table.time[self.next_beam:end] - frame_start)
+            self.next_beam = end
+
+
+TIMELINE = Timeline()
+
+
+def write_varint(file, value):
+    while value >= 0x80:
+        file.write(bytes((value & 0x7F | 0x80,)))
+        value >>= 7
+    file.write(bytes((value,)))
+
+
+def read_varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        if pos >= len(data):
+            raise ValueError("varint runs past the end of the data")
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+class InputRecorder:
+    # replay file: a header, then one (varint ticks since last change, input bits) pair per change,
+    # closed by a REPLAY_END pair on the final tick
+    def __init__(self, path, seed, step):
+        # packed first, so a seed the header can't hold fails before an empty replay file is left behind
+        header = REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, seed, step, START_TIME)
+        self.file = open(path, "wb")
+        self.file.write(header)
+        self.tick = 0
+        self.last_tick = 0
+        self.bits = 0
+
+    def record(self, bits):
+        if bits != self.bits:
+            self.write(bits)
+        self.tick += 1
+        if self.tick % 1000 == 0:
+            self.file.flush()
+
+    def write(self, bits):
+        write_varint(self.file, self.tick - self.last_tick)
+        self.file.write(bytes((bits,)))
+        self.last_tick = self.tick
+        self.bits = bits
+
+    def close(self):
+        if not self.file.closed:
+            self.write(REPLAY_END)
+            self.file.close()
+
+
+class ReplayReader:
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            data = file.read()
+        if len(data) < REPLAY_HEADER.size:
+            raise ValueError("truncated replay %s: %d bytes is shorter than the header" % (path, len(data)))
+        magic, version, self.seed, self.step, self.start_time = REPLAY_HEADER.unpack_from(data)
+        if magic != REPLAY_MAGIC or version != REPLAY_VERSION:
+            raise ValueError("%s is not a version %d replay" % (path, REPLAY_VERSION))
+        self.changes = []
+        tick = 0
+        pos = REPLAY_HEADER.size
+        while pos < len(data):
+            start = pos
+            try:
+                delta, pos = read_varint(data, pos)
+            except ValueError:
+                raise ValueError("truncated replay %s: tick delta cut off at byte %d" % (path, start)) from None
+            if pos >= len(data):
+                raise ValueError("truncated replay %s: input bits missing at byte %d" % (path, pos))
+            tick += delta
+            self.changes.append((tick, data[pos]))
+            pos += 1
+        self.end_tick = tick if self.changes and self.changes[-1][1] == REPLAY_END else None
+        self.tick = 0
+        self.next_change = 0
+
+    def finished(self):
+        return self.end_tick is not None and self.tick >= self.end_tick
+
+    def apply(self, player):
+        while self.next_change < len(self.changes) and self.changes[self.next_change][0] <= self.tick:
+            bits = self.changes[self.next_change][1]
+            if bits != REPLAY_END:
+                player.set_input_bits(bits)
+            self.next_change += 1
+        self.tick += 1
+
+
+class Bot:
+    # stands in for the keyboard: decide() sees the world every simulation tick and returns INPUT_* bits
+    def decide(self, player, bullets, beams):
+        return 0
+
+
+class DodgeBot(Bot):
+    # reference bot: tries every direction at both speeds and keeps the one whose path over the next horizon
+    # stays clearest of bullets extrapolated along their velocity and of every live beam, warned or held
+    def __init__(self, horizon=240, samples=4, interval=4, margin=12):
+        self.interval = interval
+        self.margin = margin
+        self.times = np.linspace(horizon / samples, horizon, samples)
+        self.ticks = 0
+        self.bits = 0
+        self.moves = []
+        step_x = []
+        step_y = []
+        for slow in (0, INPUT_SLOW):
+            for horizontal in (0, INPUT_LEFT, INPUT_RIGHT):
+                for vertical in (0, INPUT_UP, INPUT_DOWN):
+                    dx = (horizontal == INPUT_RIGHT) - (horizontal == INPUT_LEFT)
+                    dy = (vertical == INPUT_DOWN) - (vertical == INPUT_UP)
+                    scale = (math.sqrt(0.5) if dx and dy else 1) / (2 if slow else 1)
+                    self.moves.append(horizontal | vertical | slow)
+                    step_x.append(dx * scale)
+                    step_y.append(dy * scale)
+        self.step_x = np.array(step_x)[:, None]
+        self.step_y = np.array(step_y)[:, None]
+
+    def decide(self, player, bullets, beams):
+        self.ticks += 1
+        if (self.ticks - 1) % self.interval:
+            return self.bits
+        x = player.get_x()
+        y = player.get_y()
+        radius = player.get_radius()
+        times = self.times
+        # candidate positions, moves x sample times
+        px = np.clip(x + self.step_x * player.speed * times, radius, screen.get_width() - radius)
+        py = np.clip(y + self.step_y * player.speed * times, radius, screen.get_height() - radius)
+
+        gaps = [np.full(px.shape + (0,), np.inf)]
+        live = bullets.live()
+        speed = bullets.speed[live]
+        reach = times[-1] * (player.speed + np.abs(speed)) + radius + bullets.radius[live] + self.margin
+        near = live[np.hypot(bullets.x[live] - x, bullets.y[live] - y) <= reach]
+        if len(near):
+            bx = bullets.x[near][:, None] + bullets.x_speed[near][:, None] * bullets.speed[near][:, None] * times
+            by = bullets.y[near][:, None] + bullets.y_speed[near][:, None] * bullets.speed[near][:, None] * times
+            gaps.append(np.moveaxis(np.hypot(px[:, None] - bx, py[:, None] - by) - bullets.radius[near][:, None], 1, -1))
+
+        live = beams.live()
+        kind = beams.kind[live]
+        lines = live[kind & BEAM_CIRCULAR == 0]
+        if len(lines):
+            shift_x = beams.x_speed[lines][:, None] * beams.speed[lines][:, None] * times
+            shift_y = beams.y_speed[lines][:, None] * beams.speed[lines][:, None] * times
+            dist = point_segment_distance(px[:, None], py[:, None],
+                                          beams.x1[lines][:, None] + shift_x, beams.y1[lines][:, None] + shift_y,
+                                          beams.x2[lines][:, None] + shift_x, beams.y2[lines][:, None] + shift_y)
+            gaps.append(np.moveaxis(dist - beams.width[lines][:, None] / 2, 1, -1))
+        rings = live[kind & BEAM_CIRCULAR != 0]
+        if len(rings):
+            outer = beams.radius[rings][:, None] + beams.radius_increment[rings][:, None] * times
+            dist = np.hypot(px[:, None] - beams.cx[rings][:, None], py[:, None] - beams.cy[rings][:, None])
+            gap = np.where(beams.damage_within[rings][:, None], dist - outer,
+                           np.abs(dist - outer) - beams.width[rings][:, None] / 2)
+            gap = np.where(beams.kind[rings][:, None] & BEAM_REVERSE != 0, outer - dist, gap)
+            gaps.append(np.moveaxis(gap, 1, -1))
+
+        # overlap is what matters, sooner overlap more so; a slight pull to the centre keeps out of corners
+        gap = np.concatenate(gaps, -1) - radius
+        crowding = np.maximum(self.margin - gap, 0)
+        danger = (crowding * crowding).sum(-1) / times
+        score = danger.sum(-1) + 1e-4 * np.hypot(px[:, -1] - screen.get_width() / 2,
+                                                 py[:, -1] - screen.get_height() / 2) ** 2
+        self.bits = self.moves[int(np.argmin(score))]
+        return self.bits
+
+
+class RenderState:
+    # one frame of what draw() reads, packed so the simulation can carry on while it is drawn
+    def __init__(self):
+        self.bullets = BulletStore()
+        self.beams = BeamStore()
+        self.objects = []
+        self.color = pygame.Color(255, 0, 0)
+        self.alpha = 1
+        self.alive = True
+
+    def pack(self, alpha):
+        self.bullets.pack(BULLETS)
+        self.bullets.narrow_tests = BULLETS.narrow_tests
+        self.beams.pack(BEAMS)
+        self.objects = [obj.frozen() for obj in OBJ_LIST]
+        self.color = pygame.Color(bullet_color)
+        self.alpha = alpha
+        self.alive = player.alive
+
+
+class SimulationWorker:
+    # lock-step simulation thread. While the main thread draws the last finished frame from one RenderState,
+    # the worker runs the next frame's steps and packs the result into the other; the two only meet in
+    # wait(), once a frame, so neither buffer is ever written while it is read
+    def __init__(self):
+        self.states = [RenderState(), RenderState()]
+        self.front = 0
+        self.steps = 0
+        self.alpha = 1
+        self.pending = False
+        self.error = None
+        self.started = threading.Event()
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="simulation", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            self.started.wait()
+            self.started.clear()
+            try:
+                for step in range(self.steps):
+                    simulate(SIM_STEP)
+                self.states[1 - self.front].pack(self.alpha)
+            except BaseException as error:
+                # handed to the main thread in wait(), which would otherwise wait for this frame forever
+                self.error = error
+            finally:
+                self.done.set()
+
+    def begin(self, steps, alpha):
+        self.steps = steps
+        self.alpha = alpha
+        self.pending = True
+        self.done.clear()
+        self.started.set()
+
+    def wait(self):
+        # the frame begun last, once it is finished; the world can be touched until the next begin()
+        if self.pending:
+            self.done.wait()
+            self.pending = False
+            if self.error is not None:
+                error, self.error = self.error, None
+                raise error
+            self.front = 1 - self.front
+        return self.states[self.front]
+
+    def reset(self):
+        # a new run starts from both buffers, or the old run's last frame (and its death) would be drawn
+        # again, and acted on, by the next wait(); only called while the worker is idle
+        for state in self.states:
+            state.pack(1)
+
+
+def export_views(buffer, slots, capacities):
+    # numpy views of every ring slot's frame header and columns, each 8-byte aligned, and the total size;
+    # without a buffer only the size is worked out
+    views = []
+    offset = EXPORT_SLOTS_OFFSET
+
+    def column(count, dtype):
+        nonlocal offset
+        array = None if buffer is None else np.ndarray(count, dtype, buffer, offset)
+        offset += -(-count * dtype.itemsize // 8) * 8
+        return array
+
+    for slot in range(slots):
+        view = {"frame": column(1, EXPORT_FRAME)}
+        for group, columns in EXPORT_COLUMNS.items():
+            view[group] = {name: column(capacities[group], np.dtype(dtype)) for name, dtype in columns}
+        views.append(view)
+    return views, offset
+
+
+class StateExport:
+    # publishes the bullets, beams and players after every tick without pickling or sockets. Ticks go round a
+    # ring of slots, each with its own seqlock, so a reader copying the newest slot is only disturbed if the
+    # game laps the whole ring meanwhile. Capacities are fixed when the block is made; rows past them are
+    # left out
+    def __init__(self, name=EXPORT_NAME, bullets=65536, beams=1024, players=64, slots=4):
+        self.capacities = {"bullets": bullets, "beams": beams, "players": players}
+        size = export_views(None, slots, self.capacities)[1]
+        try:
+            self.memory = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            # another game may still be publishing to it, so it is never taken over
+            raise RuntimeError("shared memory block %r already exists; pick another --export name, or remove "
+                               "it if a crashed run left it behind" % name) from None
+        EXPORT_HEADER.pack_into(self.memory.buf, 0, EXPORT_MAGIC, EXPORT_VERSION, slots, bullets, beams, players)
+        self.latest = np.ndarray(1, np.uint64, self.memory.buf, EXPORT_LATEST_OFFSET)
+        self.latest[0] = 0
+        self.slots = export_views(self.memory.buf, slots, self.capacities)[0]
+        self.tick = 0
+
+    def publish(self):
+        self.tick += 1
+        slot = self.slots[self.tick % len(self.slots)]
+        frame = slot["frame"]
+        frame["sequence"] += 1
+
+        live = BULLETS.live()[:self.capacities["bullets"]]
+        n = len(live)
+        columns = slot["bullets"]
+        columns["x"][:n] = BULLETS.x[live]
+        columns["y"][:n] = BULLETS.y[live]
+        columns["x_velocity"][:n] = BULLETS.x_speed[live] * BULLETS.speed[live]
+        columns["y_velocity"][:n] = BULLETS.y_speed[live] * BULLETS.speed[live]
+        columns["radius"][:n] = BULLETS.radius[live]
+        columns["kind"][:n] = BULLETS.kind[live]
+        frame["bullets"] = n
+
+        live = BEAMS.live()[:self.capacities["beams"]]
+        n = len(live)
+        columns = slot["beams"]
+        for name in ("x1", "y1", "x2", "y2", "cx", "cy", "radius", "width", "kind"):
+            columns[name][:n] = getattr(BEAMS, name)[live]
+        columns["held"][:n] = BEAMS.started_hold[live]
+        frame["beams"] = n
+
+        players = (PLAYERS or [player])[:self.capacities["players"]]
+        columns = slot["players"]
+        for i, obj in enumerate(players):
+            columns["x"][i] = obj.get_x()
+            columns["y"][i] = obj.get_y()
+            columns["radius"][i] = obj.get_radius()
+            columns["health"][i] = obj.health
+            columns["alive"][i] = obj.alive
+            columns["invincible"][i] = obj.invinc < INVINC_TIME
+        frame["players"] = len(players)
+
+        frame["tick"] = self.tick
+        frame["time"] = TIMELINE.time
+        frame["color"] = tuple(bullet_color)[:3]
+        frame["sequence"] += 1
+        self.latest[0] = self.tick
+
+    def close(self):
+        # the views have to go before the block can be closed
+        self.slots = self.latest = None
+        self.memory.close()
+        self.memory.unlink()
+
+
+class StateReader:
+    # the other end of StateExport, for spectators, bots and analytics in other processes
+    def __init__(self, name=EXPORT_NAME):
+        try:
+            self.memory = shared_memory.SharedMemory(name, track=False)
+        except TypeError:
+            # before Python 3.13 attaching registers the block with this process's resource tracker, which
+            # would unlink it from under the game when we exit
+            self.memory = shared_memory.SharedMemory(name)
+            resource_tracker.unregister(self.memory._name, "shared_memory")
+        magic, version, slots, bullets, beams, players = EXPORT_HEADER.unpack_from(self.memory.buf, 0)
+        if magic != EXPORT_MAGIC or version != EXPORT_VERSION:
+            raise ValueError("%s is not a version %d state export" % (name, EXPORT_VERSION))
+        self.latest = np.ndarray(1, np.uint64, self.memory.buf, EXPORT_LATEST_OFFSET)
+        self.slots = export_views(self.memory.buf, slots, {"bullets": bullets, "beams": beams,
+                                                           "players": players})[0]
+
+    def read(self):
+        # a copy of the newest finished tick, or None before the first. The copy is retried if the slot's
+        # sequence number was odd or changed while it was taken
+        while True:
+            tick = int(self.latest[0])
+            if tick == 0:
+                return None
+            slot = self.slots[tick % len(self.slots)]
+            sequence = int(slot["frame"]["sequence"][0])
+            if sequence % 2:
+                continue
+            frame = slot["frame"][0].copy()
+            state = {"tick": int(frame["tick"]), "time": float(frame["time"]), "color": tuple(frame["color"].tolist())}
+            for group, columns in EXPORT_COLUMNS.items():
+                count = int(frame[group])
+                state[group] = {name: slot[group][name][:count].copy() for name, dtype in columns}
+            if int(slot["frame"]["sequence"][0]) == sequence:
+                return state
+
+    def close(self):
+        self.slots = self.latest = None
+        self.memory.close()
+
+
+def init_display():
+    global screen
+    pygame.init()
+    screen = pygame.display.set_mode((1000, 900), pygame.NOFRAME)
+
+
+def main(seed=None):
+    start_run(seed)
+    begin_trace()
 
     pygame.mixer.music.load("sfx\\Aeternus.wav")
     pygame.mixer.music.play(-1, START_TIME / 1000)
 
-    BULLET_EVENTS.append(BulletEvent(0, make_bullet_circle, 1))
-
-    BULLET_EVENTS.append(BulletEvent(112.5, make_sine_bullets, 7425))
-
-    BULLET_EVENTS.append(BulletEvent(60, change_bullet_color))
-
-    BULLET_EVENTS.append(BulletEvent(900, make_beams, 8100))
-
-    homing_event = BulletEvent(200, make_homing, 8000)
-    homing_event.set_initial_delay(4000)
-    BULLET_EVENTS.append(homing_event)
-
-    BULLET_EVENTS.append(BulletEvent(8600, pentagram, 8600))
-
-    circ_event = BulletEvent(50, make_circ_bullets, 12800)
-    circ_event.set_initial_delay(9050)
-    BULLET_EVENTS.append(circ_event)
-
-    BULLET_EVENTS.append(BulletEvent(9050, make_bullet_circle, 9050))
-
-    beam_event = BulletEvent(100, make_beam_through_player, 12600)
-    beam_event.set_initial_delay(9050)
-    BULLET_EVENTS.append(beam_event)
-
-    beam_grid = BulletEvent(475, make_beam_grid, 18000)
-    beam_grid.set_initial_delay(12600)
-    BULLET_EVENTS.append(beam_grid)
-
-    targeted_circles = BulletEvent(200, create_targeted_circle, 18000)
-    targeted_circles.set_initial_delay(12500)
-    BULLET_EVENTS.append(targeted_circles)
-
-    suck_event = BulletEvent(18000, bullet_suck, 18100)
-    suck_event.set_initial_delay(18000)
-    BULLET_EVENTS.append(suck_event)
-
-    beam_event_2 = BulletEvent(2500, make_bullet_circle, 26000)
-    beam_event_2.set_initial_delay(19000)
-    BULLET_EVENTS.append(beam_event_2)
+    global_loop()
 
-    burst = BulletEvent(500, falling_bombs, 26000)
-    burst.set_initial_delay(19000)
-    BULLET_EVENTS.append(burst)
 
-    slow_hell_event = BulletEvent(25, slow_hell, 35000)
-    slow_hell_event.set_initial_delay(26000)
-    BULLET_EVENTS.append(slow_hell_event)
+def capture_snapshot():
+    return {
+        "timeline": TIMELINE.capture(),
+        "bullets": BULLETS.capture(),
+        "beams": BEAMS.capture(),
+        "globals": {name: globals()[name] for name in SNAPSHOT_GLOBALS},
+        "bullet_color": tuple(bullet_color),
+        "rng": rng.getstate(),
+    }
 
-    slow_burst_event = BulletEvent(1000, slow_burst, 35000)
-    slow_burst_event.set_initial_delay(26000)
-    BULLET_EVENTS.append(slow_burst_event)
 
-    BULLET_EVENTS.append(BulletEvent(36000, outer_circle, 36100))
+def restore_snapshot(snapshot):
+    global bullet_color
+    TIMELINE.restore(snapshot["timeline"])
+    BULLETS.restore(snapshot["bullets"])
+    BEAMS.restore(snapshot["beams"])
+    globals().update(snapshot["globals"])
+    bullet_color = pygame.Color(snapshot["bullet_color"])
+    rng.setstate(snapshot["rng"])
+
+
+def build_snapshots(seed, step=SIM_STEP, interval=SNAPSHOT_INTERVAL, duration=SONG_LENGTH):
+    # the reference run: nobody at the controls and no collisions, so the player never changes the field
+    global REFERENCE_RUN
+    reset_run(seed)
+    snapshots = [capture_snapshot()]
+    REFERENCE_RUN = True
+    try:
+        while TIMELINE.time < duration:
+            step_world(step)
+            if TIMELINE.time >= len(snapshots) * interval:
+                snapshots.append(capture_snapshot())
+    finally:
+        REFERENCE_RUN = False
+    return snapshots
+
+
+def load_snapshots(seed, step=SIM_STEP):
+    # keyed on the engine and chart sources too, so editing either rebuilds the cache
+    version = hashlib.sha1()
+    for path in (__file__, CHART_PATH):
+        with open(path, "rb") as source:
+            version.update(source.read())
+    version = version.hexdigest()[:12]
+    path = os.path.join(SNAPSHOT_DIR, "%d-%g-%s.pickle" % (seed, step, version))
+    if os.path.exists(path):
+        with open(path, "rb") as file:
+            return pickle.load(file)
+    snapshots = build_snapshots(seed, step)
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    # caches from older sources can never be loaded again, whatever their seed and step
+    for name in os.listdir(SNAPSHOT_DIR):
+        if name.endswith(".pickle") and not name.endswith("-%s.pickle" % version):
+            os.remove(os.path.join(SNAPSHOT_DIR, name))
+    with open(path, "wb") as file:
+        pickle.dump(snapshots, file, pickle.HIGHEST_PROTOCOL)
+    return snapshots
+
+
+def warm_start(seed, start_time, step=SIM_STEP):
+    global REFERENCE_RUN
+    snapshots = load_snapshots(seed, step)
+    reset_run(seed)
+    snapshot = snapshots[0]
+    for candidate in snapshots:
+        if candidate["timeline"]["time"] <= start_time:
+            snapshot = candidate
+    restore_snapshot(snapshot)
+    # caught up the same way the snapshots were made, with the player idle as in the reference run
+    REFERENCE_RUN = True
+    try:
+        while TIMELINE.time + step <= start_time:
+            step_world(step)
+    finally:
+        REFERENCE_RUN = False
+
+
+def run_headless(duration=SONG_LENGTH, dt=SIM_STEP, seed=None):
+    start_run(seed, dt)
+    begin_trace()
+    simulated = 0
+    start = time.perf_counter()
+    while simulated < duration and player.alive:
+        simulate(dt)
+        simulated += dt
+        PROFILER.end_frame()
+    elapsed = time.perf_counter() - start
+    print("simulated %d ms in %.2f s (%.0f simulated ms per second), health %d" %
+          (simulated, elapsed, simulated / elapsed, player.health))
+    end_recording()
+    end_trace()
+    return simulated, elapsed
+
+
+def play_replay(path):
+    global REPLAY, START_TIME
+    replay = ReplayReader(path)
+    START_TIME = replay.start_time
+    start_run(replay.seed, replay.step)
+    REPLAY = replay
+    start = time.perf_counter()
+    while player.alive and not REPLAY.finished():
+        simulate(REPLAY.step)
+    elapsed = time.perf_counter() - start
+    simulated = REPLAY.tick * REPLAY.step
+    print("replayed %d ms of seed %d in %.2f s (%.0fx real time), health %d" %
+          (simulated, REPLAY.seed, elapsed, simulated / 1000 / elapsed, player.health))
+    REPLAY = None
+    return simulated, elapsed
+
+
+def start_recording(seed, step):
+    global RECORDER, runs_started
+    end_recording()
+    runs_started += 1
+    if RECORD_PATH is not None:
+        path = RECORD_PATH
+        if runs_started > 1:
+            # restarts get numbered files so the first run's replay isn't overwritten
+            root, ext = os.path.splitext(RECORD_PATH)
+            path = "%s-%d%s" % (root, runs_started, ext)
+        RECORDER = InputRecorder(path, seed, step)
+
+
+def end_recording():
+    global RECORDER
+    if RECORDER is not None:
+        RECORDER.close()
+        RECORDER = None
+
+
+def begin_trace():
+    if TRACE_PATH is not None and PROFILER.trace is None:
+        PROFILER.start_trace()
+
+
+def end_trace():
+    if PROFILER.trace is not None:
+        PROFILER.save_trace(TRACE_PATH)
+        PROFILER.stop_trace()
+
+
+def start_run(seed=None, step=SIM_STEP):
+    end_recording()
+    if START_TIME > 0:
+        # practice starts share one seed so its snapshot cache only has to be built once
+        warm_start(PRACTICE_SEED if seed is None else seed, START_TIME, step)
+    else:
+        reset_run(seed)
+    start_recording(RUN_SEED, step)
+    if WORKER is not None:
+        WORKER.reset()
 
-    homing_event_2 = BulletEvent(100, make_homing_2, 40000)
-    homing_event_2.set_initial_delay(36000)
-    BULLET_EVENTS.append(homing_event_2)
 
-    bullet_circle_2 = BulletEvent(125, make_bullet_circle_2, 44000)
-    bullet_circle_2.set_initial_delay(40000)
-    BULLET_EVENTS.append(bullet_circle_2)
+def reset_run(seed=None):
+    global player, bullet_color, increasing_color, RUN_SEED
 
-    pentagram_event_2 = BulletEvent(500, pentagram_2, 44000)
-    pentagram_event_2.set_initial_delay(40000)
-    BULLET_EVENTS.append(pentagram_event_2)
+    increasing_color = True
+    bullet_color = pygame.Color(255, 0, 0)
+    RUN_SEED = seed if seed is not None else random.getrandbits(63)
+    rng.seed(RUN_SEED)
 
-    BULLET_EVENTS.append(BulletEvent(44000, precision_blast, 44100))
+    TIMELINE.clear()
+    OBJ_LIST.clear()
+    BULLETS.clear()
+    BEAMS.clear()
 
-    precision_section = BulletEvent(50, precision, 50000)
-    precision_section.set_initial_delay(44000)
-    BULLET_EVENTS.append(precision_section)
+    player = Player(Circle(0, 0, 6))
+    player.set_position(screen.get_width() / 2, screen.get_height() / 2)
+    PLAYERS[:] = [player]
+    for n in range(1, PLAYER_COUNT):
+        add_player(n)
 
-    global_loop()
+    TIMELINE.load(load_chart(CHART_PATH))
 
 
-def change_bullet_color():
+def change_bullet_color(n=0):
     global increasing_color, bullet_color
     b = bullet_color.b
     r = bullet_color.r
@@ -554,32 +2609,59 @@ def change_bullet_color():
     bullet_color.r = r
 
 
+def add_player(n):
+    # extra players start spread around the first and are played by their own dodge bot
+    theta = math.tau * n / PLAYER_COUNT
+    other = Player(Circle(0, 0, 6))
+    other.set_position(screen.get_width() / 2 + 100 * math.cos(theta), screen.get_height() / 2 + 100 * math.sin(theta))
+    other.color = DIM_GREY
+    other.bot = DodgeBot()
+    PLAYERS.append(other)
+
+
 def check_col(obj):
-    col_obj = None
-    for obj2 in OBJ_LIST:
-        if obj == obj2:
-            continue
+    check_collisions([obj])
 
-        if isinstance(obj2, Beam) and obj2.intersects(obj.circ):
-            col_obj = obj2
-            break
 
-        if not isinstance(obj2, Bullet):
+def check_collisions(players):
+    # every player is tested in one batch against the beams and one against the bullets, then hits are
+    # resolved in player order: a bullet stops at the first player it hits
+    players = [obj for obj in players if obj.alive]
+    if not players:
+        return
+    if len(players) == 1:
+        obj = players[0]
+        args = obj.get_x(), obj.get_y(), obj.get_radius(), obj.prev_x, obj.prev_y
+        if len(BEAMS.collide_one(*args)) > 0:
+            obj.on_col()
+            return
+        hits = BULLETS.collide_one(*args)
+        if len(hits) > 0:
+            BULLETS.kill(hits.min())
+            obj.on_col()
+        return
+    x, y, radius, prev_x, prev_y = (np.array(values, float) for values in zip(
+        *[(obj.get_x(), obj.get_y(), obj.get_radius(), obj.prev_x, obj.prev_y) for obj in players]))
+    beam_hits = BEAMS.collide(x, y, radius, prev_x, prev_y)
+    bullet_hits = BULLETS.collide(x, y, radius, prev_x, prev_y)
+    for obj, beams, hits in zip(players, beam_hits, bullet_hits):
+        if len(beams) > 0:
+            obj.on_col()
             continue
+        hits = hits[BULLETS.alive[hits]]
+        if len(hits) > 0:
+            BULLETS.kill(hits.min())
+            obj.on_col()
 
-        h1 = obj.circ
-        h2 = obj2.circ
-        dist = math.dist([h1.x, h1.y], [h2.x, h2.y])
-        if dist <= h1.radius + h2.radius:
-            col_obj = obj2
-            break
-    if not (col_obj is None):
-        obj.on_col()
-        col_obj.on_col()
+
+def print_pool_stats():
+    print("bullets:", BULLETS.stats())
+    print("beams:", BEAMS.stats())
 
 
 def handle_keyboard(e):
     if e.key == pygame.K_SPACE and e.type == pygame.KEYDOWN:
+        print_pool_stats()
         player.kill()
         on_death()
         main()
@@ -593,38 +2675,146 @@ def handle_keyboard(e):
         player.down = e.type == pygame.KEYDOWN
     elif e.key == pygame.K_LSHIFT:
         player.slowed = e.type == pygame.KEYDOWN
+    elif e.key == pygame.K_F3 and e.type == pygame.KEYDOWN:
+        PROFILER.toggle()
 
 
 def global_loop():
     total = 0
     dt = 0
+    accumulator = 0
     while True:
         events = pygame.event.get()
+        if WORKER is not None:
+            # the keyboard, restarts and on_death() touch the world, so the worker has to be idle first
+            state = WORKER.wait()
+            PROFILER.state = state
+            PROFILER.lap(PHASE_UPDATE)
+            if not state.alive:
+                on_death()
         for e in events:
             if e.type == pygame.QUIT:
+                print_pool_stats()
+                end_recording()
+                end_trace()
                 return
             if e.type == pygame.KEYDOWN or e.type == pygame.KEYUP:
                 handle_keyboard(e)
-        for e in BULLET_EVENTS:
-            e.update(dt)
-
-        circular_beam_surface.fill((0,0,0,0))
-        screen.fill((0, 0, 0))
-        for obj in OBJ_LIST:
-            if obj.drawing:
-                obj.draw()
-            obj.update(dt)
-        screen.blit(circular_beam_surface, (0, 0))
-
-        if player not in OBJ_LIST:
+        PROFILER.lap(PHASE_INPUT)
+        # the simulation only ever advances in fixed steps; rendering shows how far we are into the next one
+        accumulator = min(accumulator + dt, MAX_FRAME_TIME)
+        if WORKER is None:
+            while accumulator >= SIM_STEP:
+                simulate(SIM_STEP)
+                accumulator -= SIM_STEP
+            rects = draw(accumulator / SIM_STEP)
+            alive = player.alive
+            if not alive:
+                on_death()
+        else:
+            steps = 0
+            while accumulator >= SIM_STEP:
+                steps += 1
+                accumulator -= SIM_STEP
+            WORKER.begin(steps, accumulator / SIM_STEP)
+            rects = draw(state.alpha, state)
+            alive = state.alive
+
+        if not alive:
             death_surface.fill((255, 0, 0))
             screen.blit(death_surface, (0, 0))
-            on_death()
-        check_col(player)
-        pygame.display.update()
+            DIRTY.invalidate()
+            rects = None
+        pygame.display.update(rects)
+        PROFILER.lap(PHASE_DISPLAY)
 
         dt = clock.tick(TMR_SPEED)
         total += dt
+        PROFILER.end_frame()
+
+
+def simulate(dt, collide=True):
+    if REPLAY is not None:
+        REPLAY.apply(player)
+    if BOT is not None:
+        player.set_input_bits(BOT.decide(player, BULLETS, BEAMS))
+    for other in PLAYERS[1:]:
+        if other.alive:
+            other.set_input_bits(other.bot.decide(other, BULLETS, BEAMS))
+    if RECORDER is not None:
+        RECORDER.record(player.get_input_bits())
+    step_world(dt)
+    if collide:
+        check_collisions(PLAYERS)
+        PROFILER.lap(PHASE_COLLISION)
+    if EXPORT is not None and not REFERENCE_RUN:
+        EXPORT.publish()
+    if TELEMETRY is not None and not REFERENCE_RUN:
+        TELEMETRY.record()
+
+
+def step_world(dt):
+    TIMELINE.advance(dt)
+    PROFILER.lap(PHASE_EVENTS)
+    for obj in OBJ_LIST:
+        obj.update(dt)
+    BEAMS.update(dt)
+    # the reference run is the same whatever the command line, so only the first player counts in it
+    targets = PLAYERS[:1] if REFERENCE_RUN else [obj for obj in PLAYERS if obj.alive] or [player]
+    BULLETS.update(dt, np.array([obj.get_x() for obj in targets]), np.array([obj.get_y() for obj in targets]),
+                   screen.get_width(), screen.get_height())
+    OBJ_LIST[:] = [obj for obj in OBJ_LIST if obj.alive]
+    PROFILER.lap(PHASE_UPDATE)
+
+
+def draw(alpha=1, state=None):
+    # state is a frame packed by the simulation worker; without one the world is drawn as it is
+    bullets, beams, objects, color = ((BULLETS, BEAMS, OBJ_LIST, bullet_color) if state is None else
+                                      (state.bullets, state.beams, state.objects, state.color))
+    rewind = (1 - alpha) * SIM_STEP
+    if FRAMEBUFFER is not None:
+        return draw_framebuffer(alpha, rewind, bullets, beams, objects, color)
+    for obj in objects:
+        if obj.drawing:
+            DIRTY.mark(*obj.bounds(alpha))
+    beams.mark_dirty(DIRTY, rewind)
+    DIRTY.mark(*bullets.bounds(alpha))
+    if PROFILER.visible:
+        DIRTY.mark(*PROFILER.bounds())
+    # None means more than the fallback share of the screen changed, so redraw all of it
+    rects = DIRTY.rects()
+    if rects is None:
+        screen.fill((0, 0, 0))
+    else:
+        for rect in rects:
+            screen.fill((0, 0, 0), rect)
+
+    for obj in objects:
+        if obj.drawing:
+            obj.draw(alpha)
+    beams.draw(screen, BEAM_OVERLAY, color, rewind)
+    bullets.draw(screen, color, alpha)
+    BEAM_OVERLAY.composite(screen)
+    SPRITES.end_frame()
+    PROFILER.lap(PHASE_DRAW)
+    if PROFILER.visible:
+        PROFILER.draw(screen)
+        PROFILER.lap(PHASE_HUD)
+    return rects
+
+
+def draw_framebuffer(alpha, rewind, bullets, beams, objects, color):
+    # the whole frame is rebuilt and sent in one blit, so there are no dirty rects; the player and the HUD
+    # are drawn over it with pygame
+    FRAMEBUFFER.render(screen, bullets, beams, color, alpha, rewind)
+    for obj in objects:
+        if obj.drawing:
+            obj.draw(alpha)
+    PROFILER.lap(PHASE_DRAW)
+    if PROFILER.visible:
+        PROFILER.draw(screen)
+        PROFILER.lap(PHASE_HUD)
+    return None
 
 
 def create_circle(circle, bullet_count, bullet_class):
@@ -637,29 +2827,27 @@ def create_circle(circle, bullet_count, bullet_class):
     return bullets
 
 
-def make_homing():
-    bullet = HomingBullet()
-    bullet.set_position(random.random() * screen.get_width(), 0)
-    bullet.homing_speed = 0.01 * TMR_SPEED / 1000
-    bullet.speed = 7.5 * TMR_SPEED / 1000
+# patterns take n, the occurrence number (or the chart counter they share), then their chart parameters;
+# speeds are in pixels per frame at TMR_SPEED
 
 
-def make_homing_2():
-    global offset
+def make_homing(n=0, homing_speed=0.01, speed=7.5):
+    bullet = HomingBullet()
+    bullet.set_position(rng.random() * screen.get_width(), 0)
+    bullet.homing_speed = homing_speed * TMR_SPEED / 1000
+    bullet.speed = speed * TMR_SPEED / 1000
 
-    radius = 200
 
+def make_homing_2(n=0, radius=200, homing_speed=0.075, homing_lifespan=2000, speed=6):
     bullet = HomingBullet()
-    bullet.set_position(radius * math.sin(offset * math.pi / 6) + player.get_x(), radius * math.cos(offset * math.pi / 6) + player.get_y())
+    bullet.set_position(radius * math.sin(n * math.pi / 6) + player.get_x(), radius * math.cos(n * math.pi / 6) + player.get_y())
     bullet.set_target(player.get_x(), player.get_y())
     bullet.x_speed *= -1
     bullet.y_speed *= -1
 
-    bullet.homing_lifespan = 2000
-    bullet.homing_speed = 0.075 * TMR_SPEED / 1000
-    bullet.speed = 6 * TMR_SPEED / 1000
-
-    offset += 1
+    bullet.homing_lifespan = homing_lifespan
+    bullet.homing_speed = homing_speed * TMR_SPEED / 1000
+    bullet.speed = speed * TMR_SPEED / 1000
 
 
 def create_pentagram(circ):
@@ -689,231 +2877,205 @@ def create_pentagram(circ):
     return beams
 
 
-def pentagram():
-    circ = Circle(screen.get_width() / 2, screen.get_height() / 2, 450)
+def pentagram(n=0, radius=450):
+    circ = Circle(screen.get_width() / 2, screen.get_height() / 2, radius)
     create_pentagram(circ)
 
 
-def pentagram_2():
-    global pentagram_offset
-    circ = Circle(screen.get_width() / 2, screen.get_height() / 2, 100 + pentagram_offset * 200)
+def pentagram_2(n=0, radius=100, spacing=200, lifespan=4000, decay=400):
+    circ = Circle(screen.get_width() / 2, screen.get_height() / 2, radius + n * spacing)
     beams = create_pentagram(circ)
     for beam in beams:
-        beam.lifespan = 4000 - pentagram_offset * 400
-    pentagram_offset += 1
+        beam.lifespan = lifespan - n * decay
 
 
-def clear_bullets():
-    for i in range(len(OBJ_LIST)):
-        if i >= len(OBJ_LIST):
-            break
-        if isinstance(OBJ_LIST[i], Bullet):
-            OBJ_LIST.pop(i)
-            i -= 1
+def clear_bullets(n=0):
+    BULLETS.clear()
 
 
-def make_sine_bullets():
-    global sine_pos
+def make_sine_bullets(n=0, amplitude=50, frequency=0.01, speed=10, lanes=11):
     bullet = SinusoidalBullet()
-    bullet.amplitude = 50
-    bullet.frequency = 0.01
-    bullet.set_position(0, screen.get_height() / 10 * (sine_pos % 11))
-    bullet.speed = 10 * TMR_SPEED / 1000
-    bullet.set_target(screen.get_width(), bullet.circ.y)
-    sine_pos += 1
+    bullet.amplitude = amplitude
+    bullet.frequency = frequency
+    bullet.set_position(0, screen.get_height() / (lanes - 1) * (n % lanes))
+    bullet.speed = speed * TMR_SPEED / 1000
+    bullet.set_target(screen.get_width(), bullet.get_y())
 
 
-def make_circ_bullets():
+def make_circ_bullets(n=0, radius=600, speed=10, bounces=1):
     bullet = BouncingBullet()
-    bullet.speed = 10 * TMR_SPEED / 1000
-    bullet.bounces_left = 1
+    bullet.speed = speed * TMR_SPEED / 1000
+    bullet.bounces_left = bounces
 
-    theta = random.random() * math.tau
-    radius = 600
+    theta = rng.random() * math.tau
 
-    bullet.circ.x = math.cos(theta) * radius + player.circ.x
-    bullet.circ.y = math.sin(theta) * radius + player.circ.y
+    bullet.set_position(math.cos(theta) * radius + player.circ.x, math.sin(theta) * radius + player.circ.y)
     bullet.set_target(player.circ.x, player.circ.y)
 
 
-def make_beam_through_player():
-    slope_factor = 2
-    slope = random.random() * slope_factor - slope_factor / 2
+def make_beam_through_player(n=0, slope_factor=2, warning=500, lifespan=75):
+    slope = rng.random() * slope_factor - slope_factor / 2
     y_int = -slope * player.get_x() + player.get_y()
 
     line = Line(0, y_int, screen.get_width(), y_int + slope * screen.get_width())
     beam = Beam(line)
-    beam.start_delay(500)
-    beam.lifespan = 75
+    beam.start_delay(warning)
+    beam.lifespan = lifespan
 
 
-def make_beams():
-    if len(OBJ_LIST) <= 1:
+def make_beams(n=0, count=5, warning=500, lifespan=75):
+    if len(OBJ_LIST) + BULLETS.live_count() + BEAMS.live_count() <= 1:
         return
-    for i in range(5):
-        line = Line(0, screen.get_height() * random.random(), screen.get_width(), screen.get_height() * random.random())
+    for i in range(count):
+        line = Line(0, screen.get_height() * rng.random(), screen.get_width(), screen.get_height() * rng.random())
         beam = Beam(line)
-        beam.start_delay(500)
-        beam.lifespan = 75
+        beam.start_delay(warning)
+        beam.lifespan = lifespan
 
 
-def make_bullet_circle():
-    circ = Circle(screen.get_width() / 2, screen.get_height() / 2, 100)
-    bullets = create_circle(circ, 20, BouncingBullet)
+def make_bullet_circle(n=0, radius=100, count=20, speed=7.5, bounces=2):
+    circ = Circle(screen.get_width() / 2, screen.get_height() / 2, radius)
+    bullets = create_circle(circ, count, BouncingBullet)
     for bullet in bullets:
         bullet.set_target(circ.x, circ.y)
         bullet.x_speed *= -1
         bullet.y_speed *= -1
 
-        bullet.bounces_left = 2
-        bullet.speed = 7.5 * TMR_SPEED / 1000
+        bullet.bounces_left = bounces
+        bullet.speed = speed * TMR_SPEED / 1000
 
 
-def make_beam_grid():
-    global offset
-    line_count = 6
+def make_beam_grid(n=0, lines=6, warning=400, lifespan=75):
+    line_count = lines
     for i in range(line_count):
-        x_pos = (i * screen.get_width() / line_count + offset) % screen.get_width()
-        y_pos = (i * screen.get_height() / line_count + offset) % screen.get_height()
+        x_pos = (i * screen.get_width() / line_count + n) % screen.get_width()
+        y_pos = (i * screen.get_height() / line_count + n) % screen.get_height()
         beam = Beam(Line(0, y_pos, screen.get_width(), y_pos))
-        beam.start_delay(400)
-        beam.lifespan = 75
+        beam.start_delay(warning)
+        beam.lifespan = lifespan
         beam2 = Beam(Line(x_pos, 0, x_pos, screen.get_height()))
-        beam2.start_delay(400)
-        beam2.lifespan = 75
-    offset += 30
+        beam2.start_delay(warning)
+        beam2.lifespan = lifespan
 
 
-def create_targeted_circle():
-    circ = Circle(screen.get_width() / 2, screen.get_height() / 2, 50)
-    bullet_count = 20
+def create_targeted_circle(n=0, radius=50, count=20, speed=7.5, growth=1):
+    circ = Circle(screen.get_width() / 2, screen.get_height() / 2, radius)
+    bullet_count = count
     for i in range(bullet_count):
         bullet = CircularBullet()
-        bullet.theta = math.tau / bullet_count * i + offset
+        bullet.theta = math.tau / bullet_count * i + n
         bullet.radius = circ.radius
         bullet.set_position(circ.x + math.cos(bullet.theta) * circ.radius,
                             circ.y + math.sin(bullet.theta) * circ.radius)
-        bullet.speed = 7.5 * (TMR_SPEED / 1000)
-        bullet.radius_increment = 1
+        bullet.speed = speed * (TMR_SPEED / 1000)
+        bullet.radius_increment = growth
 
 
-def falling_bombs():
-    for i in range(5):
-        circ = Circle(random.random() * screen.get_width(), random.random() * screen.get_height(), 150)
+def falling_bombs(n=0, count=5, radius=150, warning=1000, lifespan=200):
+    for i in range(count):
+        circ = Circle(rng.random() * screen.get_width(), rng.random() * screen.get_height(), radius)
         bomb = CircularBeam(circ)
-        bomb.lifespan = 200
-        bomb.start_delay(1000)
+        bomb.lifespan = lifespan
+        bomb.start_delay(warning)
         bomb.damage_within = True
 
 
-def bullet_suck():
-    for bullet in OBJ_LIST:
-        try:
-            bullet.rotating = False
-            bullet.radius_increment = 0
-            bullet.set_target(screen.get_width() / 2, screen.get_height() / 2)
-            bullet.speed = 10 * TMR_SPEED / 1000
-        except:
-            pass
+def bullet_suck(n=0, speed=10):
+    BEAMS.radius_increment[BEAMS.live(BEAM_CIRCULAR)] = 0
+    bullets = BULLETS.live()
+    BULLETS.rotating[bullets] = False
+    BULLETS.radius_increment[bullets] = 0
+    BULLETS.set_target(bullets, screen.get_width() / 2, screen.get_height() / 2)
+    BULLETS.speed[bullets] = speed * TMR_SPEED / 1000
 
 
-def bouncing_bullets():
+def bouncing_bullets(n=0, count=20, speed=5, homing_speed=0.005, bounces=2):
     circ = Circle(screen.get_width() / 2, screen.get_height() / 2, 10)
 
-    count = 20
     bullets = create_circle(circ, count, HomingBouncingBullet)
     for i in range(count):
         bullet = bullets[i]
-        bullet.bounces_left = 2
-        bullet.speed = 5 * TMR_SPEED / 1000
-        bullet.homing_speed = 0.005 * TMR_SPEED / 1000
+        bullet.bounces_left = bounces
+        bullet.speed = speed * TMR_SPEED / 1000
+        bullet.homing_speed = homing_speed * TMR_SPEED / 1000
         bullet.set_angle(i * math.tau / count)
         bullet.x_speed *= -1
         bullet.y_speed *= -1
 
 
-def slow_hell():
-    global slow_hell_offset
-    bullet_count = 40
+def slow_hell(n=0, count=40, speed=2):
+    bullet_count = count
+    step = n % bullet_count
     for i in range(4):
         if i == 0:
-            x_pos = slow_hell_offset * screen.get_width() / bullet_count
+            x_pos = step * screen.get_width() / bullet_count
             y_pos = 0
         elif i == 1:
-            x_pos = slow_hell_offset * screen.get_width() / bullet_count
+            x_pos = step * screen.get_width() / bullet_count
             y_pos = screen.get_height() - 6
         elif i == 2:
             x_pos = 0
-            y_pos = slow_hell_offset * screen.get_height() / bullet_count
+            y_pos = step * screen.get_height() / bullet_count
         else:
             x_pos = screen.get_width() - 6
-            y_pos = slow_hell_offset * screen.get_height() / bullet_count
+            y_pos = step * screen.get_height() / bullet_count
         bullet = Bullet()
-        bullet.speed = 2 * TMR_SPEED / 1000
-        bullet.set_angle(slow_hell_offset * (math.pi / bullet_count + math.pi))
+        bullet.speed = speed * TMR_SPEED / 1000
+        bullet.set_angle(step * (math.pi / bullet_count + math.pi))
         bullet.set_position(x_pos, y_pos)
-    slow_hell_offset += 1
-    slow_hell_offset %= bullet_count
 
 
-def slow_burst():
-    circ = Circle(random.random() * (screen.get_width() - 10) + 10, random.random() * (screen.get_height() - 10) + 10, 10)
-    bullets = create_circle(circ, 20, Bullet)
+def slow_burst(n=0, count=20, speed=2):
+    circ = Circle(rng.random() * (screen.get_width() - 10) + 10, rng.random() * (screen.get_height() - 10) + 10, 10)
+    bullets = create_circle(circ, count, Bullet)
     for i in range(len(bullets)):
         bullet = bullets[i]
-        bullet.speed = 2 * TMR_SPEED / 1000
+        bullet.speed = speed * TMR_SPEED / 1000
         bullet.set_angle(i * (math.tau / len(bullets)))
         bullet.x_speed *= -1
         bullet.y_speed *= -1
 
 
-def outer_circle():
-    for i in range(10):
-        circ = Circle(screen.get_width() / 2, screen.get_height() / 2, 200 * (i+1))
+def outer_circle(n=0, rings=10, spacing=200, shrink=0.5, bursts=10, speed=-10):
+    for i in range(rings):
+        circ = Circle(screen.get_width() / 2, screen.get_height() / 2, spacing * (i+1))
         reverse = CircularBeam(circ)
         reverse.lifespan = 200
         reverse.damage_within = False
         reverse.width = 10
         reverse.start_delay(500)
-        reverse.radius_increment = -0.5
-        reverse.bursts = 10
-    for bullet in OBJ_LIST:
-        if isinstance(bullet, Bullet):
-            bullet.speed = -10 * TMR_SPEED / 1000
-            bullet.set_target(player.get_x(), player.get_y())
-
+        reverse.radius_increment = -shrink
+        reverse.bursts = bursts
+    bullets = BULLETS.live()
+    BULLETS.speed[bullets] = speed * TMR_SPEED / 1000
+    BULLETS.set_target(bullets, player.get_x(), player.get_y())
 
-def make_bullet_circle_2():
-    global circle_2_offset
 
-    circle = Circle(screen.get_width() / 2, screen.get_height() / 2, 100 + 50 * circle_2_offset)
-    bullet_count = 20
+def make_bullet_circle_2(n=0, radius=100, spacing=50, count=20, speed=7.5):
+    circle = Circle(screen.get_width() / 2, screen.get_height() / 2, radius + spacing * n)
+    bullet_count = count
     for i in range(bullet_count):
-        theta = (circle_2_offset * math.pi / 6) + (math.tau / bullet_count * i)
+        theta = (n * math.pi / 6) + (math.tau / bullet_count * i)
 
         bullet = CircularBullet()
         bullet.radius = circle.radius
         bullet.theta = theta
         bullet.set_position(circle.x + math.cos(theta) * circle.radius,
                             circle.y + math.sin(theta) * circle.radius)
-        bullet.speed = 7.5 * TMR_SPEED / 1000
+        bullet.speed = speed * TMR_SPEED / 1000
         bullet.survive_off_screen = True
-    circle_2_offset += 1
 
 
-def precision_blast():
+def precision_blast(n=0, speed=-10):
     global precision_x
 
-    for bullet in OBJ_LIST:
-        if isinstance(bullet, CircularBullet):
-            bullet.rotating = False
-            bullet.speed = -10 * TMR_SPEED / 1000
-            bullet.set_target(player.get_x(), player.get_y())
+    bullets = BULLETS.live(CIRCULAR)
+    BULLETS.rotating[bullets] = False
+    BULLETS.speed[bullets] = speed * TMR_SPEED / 1000
+    BULLETS.set_target(bullets, player.get_x(), player.get_y())
     precision_x = player.get_x()
 
-def precision():
-    global offset, precision_x
-
+def precision(n=0, speed=5, beam_speed=10):
     for i in range(2):
         if i == 0:
             x_pos = precision_x - player.circ.radius * 4
@@ -923,25 +3085,123 @@ def precision():
             x_pos = precision_x + player.circ.radius * 4
             beam_x = x_pos + 50
             x_speed = 1
-        x_pos += math.sin(offset * 0.2) * 50
+        x_pos += math.sin(n * 0.2) * 50
         bullet = Bullet()
         bullet.set_position(x_pos, bullet.get_radius())
         bullet.y_speed = 1
-        bullet.speed = 5 * TMR_SPEED / 1000
+        bullet.speed = speed * TMR_SPEED / 1000
 
         beam = MovingBeam(Line(beam_x, 0, beam_x, screen.get_height()))
         beam.lifespan = 5000
         beam.start_delay(0)
-        beam.speed = 10 * TMR_SPEED / 1000
+        beam.speed = beam_speed * TMR_SPEED / 1000
         beam.x_speed = x_speed
 
-    offset += 1
+
+# patterns whose spawns only depend on n and their parameters are compiled into spawn rows when the chart
+# loads; the rest read the player, the run's RNG, or bullets already in play, so they are called when due
+COMPILED_PATTERNS = {
+    "make_bullet_circle": make_bullet_circle,
+    "make_sine_bullets": make_sine_bullets,
+    "pentagram": pentagram,
+    "pentagram_2": pentagram_2,
+    "make_beam_grid": make_beam_grid,
+    "create_targeted_circle": create_targeted_circle,
+    "bouncing_bullets": bouncing_bullets,
+    "slow_hell": slow_hell,
+    "make_bullet_circle_2": make_bullet_circle_2,
+}
+RUNTIME_PATTERNS = {
+    "change_bullet_color": change_bullet_color,
+    "clear_bullets": clear_bullets,
+    "make_homing": make_homing,
+    "make_homing_2": make_homing_2,
+    "make_circ_bullets": make_circ_bullets,
+    "make_beam_through_player": make_beam_through_player,
+    "make_beams": make_beams,
+    "falling_bombs": falling_bombs,
+    "bullet_suck": bullet_suck,
+    "slow_burst": slow_burst,
+    "outer_circle": outer_circle,
+    "precision_blast": precision_blast,
+    "precision": precision,
+}
+
 
 def on_death():
-    pygame.mixer.music.stop()
-    BULLET_EVENTS.clear()
+    if pygame.mixer.get_init():
+        pygame.mixer.music.stop()
+    end_recording()
+    TIMELINE.clear()
     OBJ_LIST.clear()
+    BULLETS.clear()
+    BEAMS.clear()
 
 
 player = Player(Circle(0, 0, 6))
-main()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--headless", action="store_true", help="simulate without display, audio or clock")
+    parser.add_argument("--dt", type=float, default=SIM_STEP, help="fixed headless step in ms")
+    parser.add_argument("--duration", type=float, default=SONG_LENGTH, help="headless run length in ms")
+    parser.add_argument("--seed", type=int, help="seed for the run's pattern RNG")
+    parser.add_argument("--start", type=float, default=0, help="song time in ms to start from")
+    parser.add_argument("--record", metavar="PATH", help="stream the run's inputs to a replay file")
+    parser.add_argument("--replay", metavar="PATH", help="re-simulate a recorded run headlessly")
+    parser.add_argument("--chart", default=CHART_PATH, help="song chart to play")
+    parser.add_argument("--bot", action="store_true", help="let the reference dodge bot play")
+    parser.add_argument("--players", type=int, default=1, help="players in the field; all but the first are bots")
+    parser.add_argument("--trace", metavar="PATH", help="write per-frame phase timings as Chrome trace-event JSON")
+    parser.add_argument("--hud", action="store_true", help="start with the performance overlay shown (F3 toggles)")
+    parser.add_argument("--framebuffer", action="store_true",
+                        help="draw with the NumPy software renderer, for very large bullet counts")
+    parser.add_argument("--threaded", action="store_true",
+                        help="simulate on a worker thread while the last frame is drawn, a frame behind")
+    parser.add_argument("--telemetry", metavar="PATH",
+                        help="stream per-tick counts, player state and frame timings to a compressed file")
+    parser.add_argument("--export", nargs="?", const=EXPORT_NAME, metavar="NAME",
+                        help="publish every tick's state to this shared memory block (read with StateReader)")
+    args = parser.parse_args()
+    if args.seed is not None and not 0 <= args.seed < 2 ** 64:
+        parser.error("--seed must be between 0 and 2**64 - 1, the range a replay header can hold")
+    if args.players > 1 and (args.record or args.replay):
+        parser.error("replays only hold the first player's inputs, so they can't be combined with --players")
+    if args.bot and args.replay:
+        parser.error("the bot would overwrite the replayed inputs, so --bot can't be combined with --replay")
+    RECORD_PATH = args.record
+    PLAYER_COUNT = max(args.players, 1)
+    TRACE_PATH = args.trace
+    CHART_PATH = args.chart
+    if args.bot:
+        BOT = DodgeBot()
+    if args.hud:
+        PROFILER.toggle()
+    START_TIME = args.start
+    if args.export:
+        EXPORT = StateExport(args.export)
+    if args.telemetry:
+        TELEMETRY = Telemetry(args.telemetry)
+    try:
+        if args.replay:
+            try:
+                play_replay(args.replay)
+            except ValueError as error:
+                parser.error(str(error))
+        elif args.headless:
+            run_headless(args.duration, args.dt, args.seed)
+        else:
+            init_display()
+            if args.framebuffer:
+                FRAMEBUFFER = Framebuffer(screen.get_width(), screen.get_height())
+            if args.threaded:
+                WORKER = SimulationWorker()
+            main(args.seed)
+    finally:
+        # closed separately, so a failure in one can't keep the other's last chunk from the disk
+        try:
+            if EXPORT is not None:
+                EXPORT.close()
+        finally:
+            if TELEMETRY is not None:
+                TELEMETRY.close()